@@ -5,112 +5,698 @@
 #
 
 import base64
+import concurrent.futures
 import contextlib
+import csv
+import ctypes
+import ctypes.util
+import functools
 import hashlib
 import io
 import json
 import os
+import re
+import select
 import shutil
+import socket
+import socketserver
+import struct
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import xml.etree.ElementTree as ET
 
+import pygments
 from PIL import Image
 from markdown_it import MarkdownIt
 from mdit_py_plugins.attrs import attrs_plugin
 from mdit_py_plugins.texmath import texmath_plugin
+from pygments.formatters import LatexFormatter
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
 
 
 # Colores en el orden de las secuencias de escape ANSI 0=black, 1=red, etc.
 ANSI_COLOR = ('black', 'red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white')
 
-# Comando LaTeX para compilar los PDFs
+# Colores brillantes (90-97 y 8-15 en la paleta de 256 colores) como en xterm
+ANSI_BRIGHT = ((127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0),
+               (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255))
+
+# Secuencias de escape ANSI (solo se interpretan las SGR, que acaban en m)
+ANSI_ESCAPE = re.compile(r'\x1b\[([0-9;]*)([@-~])')
+
+# Caracteres especiales del entorno Verbatim con commandchars=¤\{\}
+VERBATIM_ESCAPES = str.maketrans({'{': '¤{', '}': '¤}', '¤': '¤textcurrency{}'})
+
+# Formateador de Pygments para el código resaltado (el estilo es el de minted)
+LATEX_FORMATTER = LatexFormatter(nowrap=True, style='default')
+
+# Nombres de lenguajes que Pygments no conoce y sus equivalentes
+LEXER_ALIASES = {'ipython': 'python', 'ipython3': 'python'}
+
+# Opción de los entornos Verbatim con código resaltado
+HIGHLIGHT_ATTRS = r'commandchars=\\\{\}'
+
+# Número de fragmentos de código sin resaltar a partir del que se usan varios procesos
+PARALLEL_HIGHLIGHT = 64
+
+# Número de celdas Markdown por convertir a partir del que se reparten entre procesos
+PARALLEL_RENDER = 32
+
+# Decodificador JSON para el lector incremental de cuadernos
+DECODER = json.JSONDecoder()
+
+# Compilador LaTeX por defecto para los PDFs (véase BACKENDS)
 LATEX_CMD = 'xelatex'  # 'lualatex'
 
+# Ejecuciones de LaTeX como máximo para que el documento converja
+MAX_RUNS = 3
+
+# Nombre del trabajo LaTeX
+JOBNAME = 'cuaderno'
+
+# Versión del conversor (cambiarla invalida las compilaciones guardadas en la caché)
+VERSION = '2023.2'
+
+# Manifiesto de la compilación guardada en el directorio de la caché
+MANIFEST = 'manifest.json'
+
+# Directorio de la caché (relativo al directorio actual)
+CACHE_DIR = '.cache'
+
+# Almacén de las imágenes de las salidas ya convertidas (compartido por los cuadernos)
+ASSET_DIR = os.path.join(CACHE_DIR, 'assets')
+
+# Lista de las imágenes del almacén que usa cada directorio de construcción
+ASSET_MANIFEST = 'recursos.json'
+
+# Imágenes de las que depende el documento (se escribe al generar el LaTeX)
+DEPENDENCIES = 'dependencias.json'
+
+# Socket por defecto del modo servidor
+SOCKET = os.path.join(CACHE_DIR, 'juno.sock')
+
+# Tiempo sin cambios que se espera antes de reconvertir en el modo vigilante (segundos)
+DEBOUNCE = 0.5
+
+
+def ansi_color(code: int) -> str:
+	"""Especificación de color de xcolor para un color de la paleta de 256 colores"""
+
+	if code < 8:
+		return f'{{{ANSI_COLOR[code]}}}'
+	elif code < 16:
+		rgb = ANSI_BRIGHT[code - 8]
+	# Cubo de 6x6x6 colores
+	elif code < 232:
+		code -= 16
+		rgb = tuple(0 if c == 0 else 55 + 40 * c for c in (code // 36, code // 6 % 6, code % 6))
+	# Escala de grises
+	else:
+		rgb = (8 + 10 * (code - 232),) * 3
+
+	return '[RGB]{{{},{},{}}}'.format(*rgb)
+
+
+def parse_sgr(params: str, style: dict):
+	"""Actualiza el estilo según los parámetros de una secuencia SGR"""
+
+	codes = [int(c) if c else 0 for c in params.split(';')]
+	k = 0
+
+	while k < len(codes):
+		code = codes[k]
+
+		if code == 0:  # reset
+			style.clear()
+		elif code == 1:  # bold
+			style['bold'] = True
+		# Faint (2) no tiene equivalente y se escribe en cursiva como italic (3)
+		elif code in (2, 3):
+			style['italic' if code == 3 else 'faint'] = True
+		elif code == 4:  # underline
+			style['underline'] = True
+		elif code == 22:  # normal intensity
+			style.pop('bold', None)
+			style.pop('faint', None)
+		elif code == 23:
+			style.pop('italic', None)
+		elif code == 24:
+			style.pop('underline', None)
+		elif 30 <= code <= 37:  # foreground color
+			style['fg'] = ansi_color(code - 30)
+		elif 90 <= code <= 97:  # bright foreground color
+			style['fg'] = ansi_color(code - 82)
+		elif 40 <= code <= 47:  # background color
+			style['bg'] = ansi_color(code - 40)
+		elif 100 <= code <= 107:  # bright background color
+			style['bg'] = ansi_color(code - 92)
+		elif code == 39:
+			style.pop('fg', None)
+		elif code == 49:
+			style.pop('bg', None)
+		# Colores de 256 colores (38;5;n) y RGB (38;2;r;g;b)
+		elif code in (38, 48) and k + 1 < len(codes):
+			key = 'fg' if code == 38 else 'bg'
+
+			if codes[k + 1] == 5 and k + 2 < len(codes):
+				style[key] = ansi_color(codes[k + 2] % 256)
+				k += 2
+			elif codes[k + 1] == 2 and k + 4 < len(codes):
+				style[key] = '[RGB]{{{},{},{}}}'.format(*(min(c, 255) for c in codes[k + 2:k + 5]))
+				k += 4
+			else:
+				k += 1
+
+		k += 1
+
+
+def open_style(style: dict) -> str:
+	"""Comandos LaTeX que abren los grupos del estilo (¤ hace de barra invertida)"""
+
+	# El fondo es el grupo más externo y los atributos del texto los más internos
+	parts = []
+
+	if bg := style.get('bg'):
+		parts.append(f'¤ansibg{{{bg}}}{{')
+	if fg := style.get('fg'):
+		parts.append(f'¤textcolor{fg}{{')
+	if style.get('bold'):
+		parts.append('¤textbf{')
+	if style.get('italic') or style.get('faint'):
+		parts.append('¤textit{')
+	if style.get('underline'):
+		parts.append('¤underline{')
+
+	return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=1024)
+def sgr_transition(style: frozenset, params: str) -> tuple[frozenset, str]:
+	"""Estilo resultante de aplicar una secuencia SGR y texto LaTeX que lo abre"""
+
+	new_style = dict(style)
+	parse_sgr(params, new_style)
+
+	return frozenset(new_style.items()), open_style(new_style)
+
 
 def convert_ansi(texts):
-	"""Remove ANSI escape codes"""
+	"""Convert ANSI escape codes to LaTeX commands for a Verbatim environment"""
 
-	# Output list, whether , whether in an ANSI escape and nesting level
-	output, code, in_ansi, level = [], 0, False, 0
-	# Whether a foreground or background color is in place
-	fg, bg = False, False
+	# Output list and current style
+	output, style = [], frozenset()
+	# Text that opens and closes the groups of the current style
+	opening, closing = '', ''
 
-	# For each line, and each character
 	for text in texts:
-		for c in text:
-			if in_ansi:
-				if c == '[':  # part of the syntax
-					pass
-				# ; or m indicate the end of a ANSI code
-				elif c not in ';m':
-					code = 10 * code + int(c)
-				else:
-					if code == 0:  # reset
-						output.append('}' * level)
-						level, bg, fg = 0, False, False
-					elif code == 1:  # bold
-						output.append('¤textbf{')
-						level += 1
-					elif code == 2:  # italic
-						output.append('¤textit{')
-						level += 1
-					elif 30 <= code <= 37:  # foreground color
-						if fg:
-							output.append('}')
-							level -= 1
-						output.append(f'¤textcolor{{{ANSI_COLOR[code % 10]}}}{{')
-						level += 1
-						fg = True
-					# This does not work out of the box, but it does not matter
-					# elif 40 <= code <= 47:  # background color
-					#	if bg:
-					#		output.append('}')
-					#		level -= 1
-					#	output.append(f'¤colorbox{{{ANSI_COLOR[code % 10]}}}{{')
-					#	level += 1
-					#	bg = True
-
-					# m (unlike ;) moves back to normal mode
-					if c == 'm':
-						in_ansi = False
-			# Escape character
-			elif c == '\x1b':
-				in_ansi, code = True, 0
-			else:
-				output.append(c)
-		output.append('\n')
+		# The split alternates plain text runs, which are copied in bulk,
+		# with the parameters and final byte of each escape sequence
+		parts = ANSI_ESCAPE.split(text)
+
+		for k in range(0, len(parts), 3):
+			if run := parts[k]:
+				run = run.translate(VERBATIM_ESCAPES)
+				# Groups cannot span several lines in a Verbatim environment
+				if closing and '\n' in run:
+					run = run.replace('\n', f'{closing}\n{opening}')
+				output.append(run)
+
+			# Other control sequences (cursor movement, etc.) are dropped
+			if k + 2 < len(parts) and parts[k + 2] == 'm':
+				style, new_opening = sgr_transition(style, parts[k + 1])
+
+				if new_opening != opening:
+					output.append(closing)
+					output.append(new_opening)
+					opening, closing = new_opening, '}' * new_opening.count('¤')
+
+		output.append(f'{closing}\n{opening}')
+
+	output.append(closing)
 
 	return [''.join(output)]
 
 
-def svg2pdf(source_file: str, target_file: str):
+class Profiler:
+	"""Tiempos de las fases y celdas de la conversión de un cuaderno"""
+
+	def __init__(self, name: str):
+		self.name = name  # nombre del cuaderno
+		self.start = time.perf_counter()
+		self.total = 0.0  # duración total (al terminar)
+		self.stages = {}  # tiempo acumulado de cada fase
+		self.counters = {}  # contadores (procesos lanzados, etc.)
+		self.cells = []  # tiempo de escritura de cada celda
+		self.lock = threading.Lock()
+
+	def add(self, stage: str, seconds: float):
+		with self.lock:
+			self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+	def count(self, counter: str, n=1):
+		with self.lock:
+			self.counters[counter] = self.counters.get(counter, 0) + n
+
+	@contextlib.contextmanager
+	def stage(self, stage: str):
+		"""Mide el tiempo de un bloque como parte de una fase"""
+
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add(stage, time.perf_counter() - start)
+
+	def timed(self, iterable, stage: str):
+		"""Recorre un iterable midiendo el tiempo de obtener cada elemento"""
+
+		iterator, start = iter(iterable), time.perf_counter()
+
+		for item in iterator:
+			self.add(stage, time.perf_counter() - start)
+			yield item
+			start = time.perf_counter()
+
+		self.add(stage, time.perf_counter() - start)
+
+	def cell(self, index: int, cell_type: str, seconds: float):
+		self.cells.append({'índice': index, 'tipo': cell_type, 'segundos': seconds})
+
+	def finish(self):
+		self.total = time.perf_counter() - self.start
+
+	def report(self) -> dict:
+		return {
+			'cuaderno': self.name,
+			'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'versión': VERSION,
+			'total': self.total,
+			'fases': self.stages,
+			'contadores': self.counters,
+			'celdas': self.cells,
+		}
+
+	def save(self, directory: str):
+		"""Guarda el informe en JSON y CSV en el directorio indicado"""
+
+		os.makedirs(directory, exist_ok=True)
+		base = os.path.join(directory, os.path.splitext(os.path.basename(self.name))[0])
+
+		with open(f'{base}.json', 'w') as jfile:
+			json.dump(self.report(), jfile, indent=1, ensure_ascii=False)
+
+		with open(f'{base}.csv', 'w', newline='') as cfile:
+			writer = csv.writer(cfile)
+			writer.writerow(('clase', 'nombre', 'valor'))
+			writer.writerow(('total', '', f'{self.total:.6f}'))
+			writer.writerows(('fase', stage, f'{seconds:.6f}') for stage, seconds in self.stages.items())
+			writer.writerows(('contador', counter, n) for counter, n in self.counters.items())
+			writer.writerows((f'celda {cell["tipo"]}', cell['índice'], f'{cell["segundos"]:.6f}')
+			                 for cell in self.cells)
+
+
+def print_profile_summary(profilers, directory: str | None = None, top=10):
+	"""Muestra (y guarda si se indica directorio) el resumen de varios informes"""
+
+	profilers = list(profilers)
+	stages = sorted({stage for profiler in profilers for stage in profiler.stages})
+
+	# Tabla con el tiempo de cada fase por cuaderno
+	width = max((len(profiler.name) for profiler in profilers), default=8)
+	print(f'{"cuaderno":{width}}', *(f'{stage:>10}' for stage in stages), f'{"total":>10}')
+
+	for profiler in profilers:
+		print(f'{profiler.name:{width}}', *(f'{profiler.stages.get(stage, 0.0):10.3f}' for stage in stages),
+		      f'{profiler.total:10.3f}')
+
+	print(f'{"suma":{width}}', *(f'{sum(p.stages.get(stage, 0.0) for p in profilers):10.3f}' for stage in stages),
+	      f'{sum(p.total for p in profilers):10.3f}')
+
+	# Celdas más costosas de todo el lote
+	cells = sorted(((cell['segundos'], profiler.name, cell['índice'], cell['tipo'])
+	                for profiler in profilers for cell in profiler.cells), reverse=True)[:top]
+
+	if cells:
+		print('\nCeldas más lentas:')
+		for seconds, name, index, cell_type in cells:
+			print(f'{seconds:10.4f}  {name} [{index}] ({cell_type})')
+
+	if directory is not None:
+		os.makedirs(directory, exist_ok=True)
+
+		with open(os.path.join(directory, 'resumen.json'), 'w') as sfile:
+			json.dump({
+				'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+				'fases': {stage: sum(p.stages.get(stage, 0.0) for p in profilers) for stage in stages},
+				'cuadernos': {p.name: {'total': p.total, 'fases': p.stages, 'contadores': p.counters}
+				              for p in profilers},
+				'celdas más lentas': [{'cuaderno': name, 'índice': index, 'tipo': cell_type, 'segundos': seconds}
+				                      for seconds, name, index, cell_type in cells],
+			}, sfile, indent=1, ensure_ascii=False)
+
+
+@contextlib.contextmanager
+def atomic_file(target_file: str):
+	"""Nombre temporal para escribir un archivo que se renombra al destino al terminar
+
+	El nombre incluye el proceso y el hilo, así que las escrituras simultáneas
+	(incluso de otros procesos que comparten la caché) no usan el mismo archivo
+	y nadie ve nunca un archivo a medio escribir.
+	"""
+
+	tmp_file = f'{target_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+	try:
+		yield tmp_file
+		os.replace(tmp_file, target_file)
+
+	except BaseException:
+		with contextlib.suppress(OSError):
+			os.unlink(tmp_file)
+		raise
+
+
+def svg2pdf(source_file: str, target_file: str) -> bool:
 	"""Convierte un archivo SVG a PDF"""
-	subprocess.run(['rsvg-convert', source_file, '-f', 'pdf', '-o', target_file])
+	return subprocess.run(['rsvg-convert', source_file, '-f', 'pdf', '-o', target_file]).returncode == 0
+
+
+def link_file(source_file: str, target_file: str):
+	"""Enlaza (o copia si no es posible) un archivo en otra ubicación"""
+
+	# Si ya es el mismo archivo no hay nada que hacer
+	with contextlib.suppress(OSError):
+		if os.path.samefile(source_file, target_file):
+			return
+
+	with atomic_file(target_file) as tmp_file:
+		try:
+			os.link(source_file, tmp_file)
+		# Puede que estén en sistemas de archivos distintos
+		except OSError:
+			shutil.copy(source_file, tmp_file)
+
+
+class SvgConverter:
+	"""Conversión de SVG a PDF con una caché por contenido compartida entre cuadernos
+
+	Las conversiones se encargan con request y se hacen todas a la vez y en
+	paralelo con run, que luego enlaza los PDF en los directorios de construcción
+	y devuelve los archivos fuente que no se han podido convertir.
+	"""
+
+	def __init__(self, cache_dir: str, workers=None):
+		self.cache_dir = cache_dir  # directorio de los PDF convertidos
+		self.workers = workers
+		self.requests = []  # pares de archivo fuente y destino pendientes
+
+	def request(self, source_file: str, target_file: str):
+		"""Encarga la conversión de un archivo SVG a PDF"""
+		self.requests.append((source_file, target_file))
+
+	def cached_file(self, source_file: str) -> str:
+		"""Nombre del PDF convertido en la caché"""
+		return os.path.join(self.cache_dir, f'{file_digest(source_file)}.pdf')
+
+	def convert(self, source_file: str, cached_file: str) -> bool:
+		# Se convierte con otro nombre para que nunca quede a medias en la caché
+		try:
+			with atomic_file(cached_file) as tmp_file:
+				if not svg2pdf(source_file, tmp_file):
+					raise OSError(f'rsvg-convert no ha podido convertir {source_file}')
+		except OSError:
+			return False
+
+		return True
+
+	def run(self, profiler: Profiler | None = None) -> set[str]:
+		"""Realiza las conversiones pendientes y devuelve las fuentes que han fallado"""
+
+		if profiler is None:
+			profiler = Profiler('svg')
+
+		with profiler.stage('svg'):
+			return self.run_pending(profiler)
+
+	def run_pending(self, profiler: Profiler) -> set[str]:
+		# Cada archivo fuente se identifica por el resumen de su contenido
+		# (los que no se pueden leer cuentan como conversiones fallidas)
+		cached = {}
+
+		for source_file in {source for source, _ in self.requests}:
+			try:
+				cached[source_file] = self.cached_file(source_file)
+			except OSError:
+				cached[source_file] = None
+
+		# Solo hay que convertir los que no se hayan convertido nunca
+		missing = {cached_file: source_file for source_file, cached_file in cached.items()
+		           if cached_file is not None and not os.path.exists(cached_file)}
+
+		profiler.count('procesos', len(missing))
+
+		with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+			failed = {cached_file for cached_file, ok in zip(missing, pool.map(self.convert, missing.values(), missing))
+			          if not ok}
+
+		failed_sources = {source_file for source_file, cached_file in cached.items()
+		                  if cached_file is None or cached_file in failed}
+
+		for source_file in failed_sources:
+			print(f'Error al convertir {source_file} a PDF')
+
+		for source_file, target_file in self.requests:
+			if source_file not in failed_sources:
+				os.makedirs(os.path.dirname(target_file), exist_ok=True)
+				link_file(cached[source_file], target_file)
+
+		self.requests.clear()
+
+		return failed_sources
+
+
+@functools.lru_cache(maxsize=None)
+def get_lexer(lang: str):
+	"""Analizador léxico de Pygments para un lenguaje (texto plano si no se conoce)"""
+
+	try:
+		return get_lexer_by_name(LEXER_ALIASES.get(lang, lang) or 'text')
+	except ClassNotFound:
+		return get_lexer_by_name('text')
+
+
+def highlight_code(code: str, lang: str) -> str:
+	"""Resalta código con Pygments como comandos LaTeX para un entorno Verbatim"""
+	return pygments.highlight(code, get_lexer(lang), LATEX_FORMATTER)
+
+
+class Highlighter:
+	"""Resaltado de código con Pygments y caché en disco compartida por los cuadernos"""
+
+	def __init__(self, cache_dir: str | None = None, workers=None):
+		self.cache_dir = cache_dir  # directorio de la caché (si se guarda en disco)
+		self.workers = workers  # número de procesos para prefetch
+		self.memory = {}  # código resaltado por clave
+
+		if cache_dir is not None:
+			os.makedirs(cache_dir, exist_ok=True)
+
+	@staticmethod
+	def key(code: str, lang: str) -> str:
+		return hashlib.sha1(f'{pygments.__version__}\0{lang}\0{code}'.encode('utf-8')).hexdigest()
+
+	def lookup(self, key: str) -> str | None:
+		"""Busca el código resaltado en memoria y en disco"""
+
+		if (result := self.memory.get(key)) is None and self.cache_dir is not None:
+			with contextlib.suppress(OSError):
+				with open(os.path.join(self.cache_dir, f'{key}.tex')) as cfile:
+					result = self.memory[key] = cfile.read()
+
+		return result
+
+	def store(self, key: str, result: str):
+		self.memory[key] = result
+
+		if self.cache_dir is not None:
+			with atomic_file(os.path.join(self.cache_dir, f'{key}.tex')) as tmp_file:
+				with open(tmp_file, 'w') as cfile:
+					cfile.write(result)
+
+	def block(self, code: str, lang: str) -> str:
+		"""Resalta un bloque de código"""
+
+		key = self.key(code, lang)
+
+		if (result := self.lookup(key)) is None:
+			result = highlight_code(code, lang)
+			self.store(key, result)
+
+		return result
+
+	def inline(self, code: str, lang: str) -> str:
+		"""Resalta un fragmento de código en línea"""
+		return self.block(code, lang).rstrip('\n')
+
+	def prefetch(self, snippets):
+		"""Resalta de una vez y en paralelo los fragmentos que no estén en la caché"""
+
+		missing = {}
+
+		for code, lang in snippets:
+			if (key := self.key(code, lang)) not in missing and self.lookup(key) is None:
+				missing[key] = (code, lang)
+
+		# Con pocos fragmentos no compensa arrancar procesos
+		if len(missing) < PARALLEL_HIGHLIGHT or self.workers == 1:
+			return
+
+		with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+			codes, langs = zip(*missing.values())
+			for key, result in zip(missing, pool.map(highlight_code, codes, langs, chunksize=16)):
+				self.store(key, result)
+
+
+class AssetTracker:
+	"""Dependencias de imágenes de un documento
+
+	Registra qué archivo del directorio de construcción corresponde a cada
+	imagen fuente y solo convierte o enlaza los que no están al día.
+	"""
+
+	def __init__(self, svg: SvgConverter):
+		self.svg = svg  # conversor de imágenes SVG
+		self.targets = {}  # archivo en el directorio de construcción de cada fuente
+		self.mtimes = {}  # fecha de modificación de las fuentes (se consulta una sola vez)
+
+	@property
+	def sources(self):
+		return self.targets.keys()
+
+	def source_mtime(self, source_file: str) -> int:
+		if (mtime := self.mtimes.get(source_file)) is None:
+			mtime = self.mtimes[source_file] = os.stat(source_file).st_mtime_ns
+
+		return mtime
+
+	def is_stale(self, source_file: str, target_file: str) -> bool:
+		"""Comprueba si el archivo de destino es anterior a la fuente"""
+
+		try:
+			return os.stat(target_file).st_mtime_ns < self.source_mtime(source_file)
+		except FileNotFoundError:
+			return True
+
+	def require(self, source_file: str, target_file: str) -> str:
+		"""Prepara una imagen en el directorio de construcción y devuelve su ruta allí"""
+
+		# La imagen ya se ha incluido antes en el documento
+		if (known := self.targets.get(source_file)) is not None:
+			return known
+
+		os.makedirs(os.path.dirname(target_file), exist_ok=True)
+
+		# Si es SVG hay que convertirlo antes de PDF para incluirlo en el documento LaTeX
+		# y esto se hace con rsvg-convert, que debería estar instalado (la conversión
+		# se hace al terminar de escribir el documento junto con la de los demás)
+		if source_file.endswith('.svg'):
+			target_file = target_file[:-3] + 'pdf'
+
+			if self.is_stale(source_file, target_file):
+				self.svg.request(source_file, target_file)
+
+		# En caso contrario, se supone que la imagen está soportada por LaTeX y se pone
+		# simplemente un enlace simbólico a la imagen original
+		else:
+			source_path = os.path.abspath(source_file)
+
+			if not os.path.islink(target_file) or os.readlink(target_file) != source_path:
+				with atomic_file(target_file) as tmp_file:
+					os.symlink(source_path, tmp_file)
+
+		self.targets[source_file] = target_file
+		return target_file
+
+
+class FragmentBuffer:
+	"""Salida que acumula en una lista los fragmentos de texto escritos
+
+	Es mucho más barata que escribir cada fragmento en un archivo y permite
+	generar por separado el texto de cada celda y unirlo después en orden.
+	"""
+
+	def __init__(self):
+		self.parts = []
+		self.write = self.parts.append
+
+	def getvalue(self) -> str:
+		return ''.join(self.parts)
 
 
 class LaTeXWriter:
 	"""LateX for MarkdownIt streams"""
 
+	# Versión del escritor (cambiarla al modificar el LaTeX que genera
+	# invalida los fragmentos guardados en la caché)
+	VERSION = 3
+
 	HEADINGS = {
-		'h1': '',
+		'h1': 'chapter',  # solo en los libros (véase heading_open)
 		'h2': 'section',
 		'h3': 'subsection',
 	}
 
-	def __init__(self, out, md, source_dir, build_dir):
+	# Alineación de las columnas de las tablas según el estilo que indica MarkdownIt
+	ALIGNMENTS = {
+		'text-align:left': 'l',
+		'text-align:center': 'c',
+		'text-align:right': 'r',
+	}
+
+	# Tipos de elemento que se procesan con el método del mismo nombre
+	HANDLED = frozenset((
+		'paragraph_open', 'paragraph_close', 'inline', 'text', 'softbreak',
+		'em_open', 'em_close', 'strong_open', 'strong_close', 'link_open', 'link_close',
+		'code_inline', 'code_block', 'fence', 'heading_open', 'heading_close',
+		'html_inline', 'image', 'blockquote_open', 'blockquote_close',
+		'math_inline', 'math_single', 'math_block',
+		'bullet_list_open', 'bullet_list_close', 'ordered_list_open', 'ordered_list_close',
+		'list_item_open', 'list_item_close', 'table_open',
+	))
+
+	# Elementos que no generan nada (bloques HTML como los comentarios)
+	IGNORED = frozenset(('html_block',))
+
+	def __init__(self, out, md, source_dir, build_dir, assets, highlighter):
 		self.out = out  # flujo de salida (típicamente, archivo .tex)
 		self.md = md  # parseador de Markdown
+		self.highlighter = highlighter  # resaltado de código
+		self.profiler = Profiler('')  # tiempos de parseo y escritura
 		self.source_dir = source_dir  # directorio fuente (para imágenes)
 		self.build_dir = build_dir  # directorio de construcción
+		self.assets = assets  # imágenes incluidas en el documento
 		self.needs_indent = False  # si hace falta identar el siguiente párrafo
 		self.cell_metadata = None  # metadatos de la celda
+		self.cell_images = []  # imágenes incluidas en la celda actual
+		self.stream = iter(())  # elementos pendientes del flujo que se procesa
+		self.warnings = []  # avisos sobre elementos que no se han podido convertir
+		self.prerendered = {}  # fragmentos convertidos de antemano en otros procesos
+		self.book = False  # si los cuadernos son capítulos de un libro
+		self.dispatch = self.make_dispatch()  # método para cada tipo de elemento
+
+	def make_dispatch(self):
+		"""Tabla con el método que procesa cada tipo de elemento"""
+
+		dispatch = {name: getattr(self, name) for name in self.HANDLED}
 
-		# For tables
-		self.column_count = 0  # número de columnas vistas
-		self.out_stack = []  # pila de flujos de salida (véase el apartado de tablas)
-		self.first_col = True  # si esta es la primera columna
+		# Los elementos ignorados no llegan a llamar a ningún método
+		dispatch.update(dict.fromkeys(self.IGNORED))
+
+		return dispatch
 
 	def process(self, stream, metadata=None):
 		"""Procesa un flujo de elemento parseados por MarkdownIt"""
@@ -120,12 +706,30 @@ class LaTeXWriter:
 			# Código TeX previo indicado en los metadatos
 			if pretex := metadata.get('pretex'):
 				self.out.write(pretex + ' ')
-		for token in stream:
-			self.handle(token)
-
-	def handle(self, token):
-		# Delega en el método de la clase cuyo nombre coincide con el tipo de elemento
-		getattr(self, token.type, self.unknown)(token)
+		# Algunos elementos (las tablas) leen por adelantado los siguientes
+		stream, self.stream = self.stream, iter(stream)
+		dispatch, unknown = self.dispatch, self.unknown
+		try:
+			for token in self.stream:
+				if (handler := dispatch.get(token.type, unknown)) is not None:
+					handler(token)
+		finally:
+			self.stream = stream
+
+	def render(self, source, metadata):
+		"""Convierte una celda Markdown a LaTeX y devuelve el texto generado"""
+		self.cell_images = []
+
+		with self.profiler.stage('markdown'):
+			tokens = self.md.parse(source)
+
+		out, self.out = self.out, FragmentBuffer()
+		try:
+			with self.profiler.stage('escritor'):
+				self.process(tokens, metadata)
+			return self.out.getvalue()
+		finally:
+			self.out = out
 
 	def paragraph_open(self, token):
 		self.out.write('\n\\medskip ' if self.needs_indent else '\n\\noindent ')
@@ -167,11 +771,14 @@ class LaTeXWriter:
 
 	def code_inline(self, token):
 		if style := token.attrs.get('class'):
-			self.out.write(f'\\mintinline[breaklines]{{{style}}}£{token.content}£')
+			self.out.write(f'\\texttt{{{self.highlighter.inline(token.content, style)}}}')
 		else:
 			# Jupyter no entiende la notación {.} así que se asume Python
 			# (salvo indicación en contra para la celda con class, si hubiera necesidad)
-			self.out.write(f'\\mintinline[breaklines, breakafter=/, breakaftersymbolpre=]{{python}}£{token.content}£')
+			code = self.highlighter.inline(token.content, 'python')
+			# Se permite partir la línea tras las barras (como en rutas de archivos)
+			code = code.replace('/', r'/\allowbreak{}')
+			self.out.write(f'\\texttt{{{code}}}')
 
 	def code_block(self, token):
 		self.out.write(r'\begin{verbatim}')
@@ -179,16 +786,17 @@ class LaTeXWriter:
 		self.out.write(r'\end{verbatim}')
 
 	def fence(self, token):
-		self.out.write(f'\\begin{{minted}}[xleftmargin=1em]{{{token.info}}}\n')
-		self.out.write(token.content)
-		self.out.write('\\end{minted}\n')
+		self.out.write(f'\\begin{{Verbatim}}[{HIGHLIGHT_ATTRS},xleftmargin=1em]\n')
+		self.out.write(self.highlighter.block(token.content, token.info))
+		self.out.write('\\end{Verbatim}\n')
 		self.needs_indent = False
 
 	## Encabezados
 
 	def heading_open(self, token):
-		# El primer encabezado es el título del documento y los siguientes encabezados normales
-		if token.tag == 'h1':
+		# El primer encabezado es el título del documento (o del capítulo en
+		# los libros) y los siguientes encabezados normales
+		if token.tag == 'h1' and not self.book:
 			self.out.write(r'\begin{center}{\bfseries\Large ' + '\n')
 		else:
 			variant = self.HEADINGS[token.tag]
@@ -198,7 +806,7 @@ class LaTeXWriter:
 			self.out.write(f'\\{variant}{{')
 
 	def heading_close(self, token):
-		if token.tag == 'h1':
+		if token.tag == 'h1' and not self.book:
 			self.out.write(r'}\\[.5ex] Informática – Facultad de Ciencias Matemáticas (UCM) \\[.2ex]'
 			               r'\small \today \end{center}\vspace{2em}')
 		else:
@@ -222,7 +830,7 @@ class LaTeXWriter:
 			# Se espera un atributo text con el texto Markdown de la nota
 			try: text = ET.fromstring(token.content).get('text')
 			except ET.ParseError:
-				print('Error en la nota al pie', token.content)
+				self.warnings.append(f'nota al pie incorrecta: {token.content}')
 				return
 
 			# Hace falta el parseador Markdown para parsear este texto
@@ -234,25 +842,7 @@ class LaTeXWriter:
 
 	def image(self, token):
 		# Ubicación de la imagen
-		src = token.attrs['src']
-
-		# La copia al directorio de construcción
-		source_file = os.path.join(self.source_dir, src)
-		target_file = os.path.join(self.build_dir, src)
-		os.makedirs(os.path.dirname(target_file), exist_ok=True)
-
-		# Comprobar si el archivo ya existe (se podría haber incluido varias veces)
-		if not os.path.exists(target_file) or os.getmtime(target_file) < os.getmtime(source_file):
-			# Si es SVG hay que convertirlo antes de PDF para incluirlo en el documento LaTeX
-			# y esto se hace con rsvg-convert, que debería estar instalado
-			if src.endswith('.svg'):
-				target_file = target_file[:-3] + 'pdf'
-				src = src[:-3] + 'pdf'
-				svg2pdf(source_file, target_file)
-			# En caso contrario, se supone que la imagen está soportada por LaTeX y se pone
-			# simplemente un enlace simbólico a la imagen original
-			else:
-				os.symlink(source_file, target_file)
+		src = self.stage_image(token.attrs['src'])
 
 		# Modificaciones a la imagen según los metadatos de la celda (anchura)
 		tweaks = ''
@@ -262,6 +852,16 @@ class LaTeXWriter:
 
 		self.out.write(f'\n\\begin{{center}}\\includegraphics{tweaks}{{{src}}}\\end{{center}}')
 
+	def stage_image(self, src):
+		"""Copia una imagen al directorio de construcción y devuelve su nombre allí"""
+
+		self.cell_images.append(src)
+
+		target_file = self.assets.require(os.path.join(self.source_dir, src),
+		                                  os.path.join(self.build_dir, src))
+
+		return os.path.relpath(target_file, self.build_dir)
+
 	## Citas (usa el entorno quotation)
 
 	def blockquote_open(self, token):
@@ -307,69 +907,73 @@ class LaTeXWriter:
 	## Tablas (con tabular y booktabs)
 
 	def table_open(self, token):
-		self.out.write('\n\\begin{center}\\begin{tabular}')
-
-	def table_close(self, token):
-		self.out.write(r'\bottomrule')
-		self.out.write('\\end{tabular}\n\\end{center}\n')
-
-	def thead_open(self, token):
-		self.column_count = 0
-		# No sabremos el número de columnas hasta leer la primera fila y
-		# tenemos que indicarlo ahora, así que reemplazamos out para retrasar
-		# la impresión del encabezado
-		self.out_stack.append(self.out)
-		self.out = io.StringIO()
-
-	def thead_close(self, token):
-		header_row = self.out.getvalue()
-		self.out = self.out_stack.pop()
+		# Se leen de antemano todas las filas de la tabla, porque hay que
+		# indicar el número de columnas y su alineación antes que su contenido
+		header, rows, alignments = None, [], []
+		row, in_head = None, False
+
+		for token in self.stream:
+			if token.type == 'table_close':
+				break
+			elif token.type == 'thead_open':
+				in_head = True
+			elif token.type == 'thead_close':
+				in_head = False
+			elif token.type == 'tr_open':
+				row = []
+			elif token.type == 'tr_close':
+				if in_head:
+					header = row
+				else:
+					rows.append(row)
+			elif token.type in ('th_open', 'td_open'):
+				row.append('')
+				# La alineación de las columnas se toma de la primera fila
+				if not rows and header is None:
+					alignments.append(self.ALIGNMENTS.get(token.attrs.get('style'), 'l'))
+			elif token.type == 'inline':
+				row[-1] = self.render_inline(token)
 
-		# Imprime la especificación de columnas
-		spec = '{' + ' '.join('l' * self.column_count) + '}\\toprule\n'
-		self.out.write(spec)
+		lines = ['\n\\begin{center}\\begin{tabular}{', ' '.join(alignments), '}\\toprule\n']
 
 		# Imprime el encabezado (si no es vacío)
-		if header_row.strip(' &\t \\\n'):
-			self.out.write(header_row)
-			self.out.write(r'\midrule')
+		if header and any(cell.strip() for cell in header):
+			lines += ('\t', ' & '.join(header), ' \\\\\n', r'\midrule')
 
-	def tr_open(self, token):
-		self.first_col = True
+		for row in rows:
+			lines += ('\t', ' & '.join(row), ' \\\\\n')
 
-	def tr_close(self, token):
-		self.out.write(r' \\' + '\n')
+		lines.append('\\bottomrule\\end{tabular}\n\\end{center}\n')
+		self.out.write(''.join(lines))
 
-	def th_open(self, token):
-		self.column_count += 1
-		self.td_open(token)
-
-	def td_open(self, token):
-		# Imprime un salto de columna (&) salvo antes de la primera
-		if not self.first_col:
-			self.out.write(' & ')
-		else:
-			self.out.write('\t')
-			self.first_col = False
-
-	def th_close(self, token):
-		pass
-
-	def tbody_open(self, token):
-		pass
-
-	def tbody_close(self, token):
-		pass
+	def render_inline(self, token):
+		"""Convierte a LaTeX el contenido de una celda de la tabla"""
 
-	def td_close(self, token):
-		pass
+		out, self.out = self.out, FragmentBuffer()
+		try:
+			self.process(token.children)
+			return self.out.getvalue()
+		finally:
+			self.out = out
 
 	def unknown(self, token):
-		input(f'Token desconocido: {token}')
+		# Se avisa al terminar el cuaderno en lugar de detener la conversión
+		self.warnings.append(f'elemento desconocido {token.type}: {token.content or token.markup}')
 
 
 # Preámbulo del documento LaTeX para generar (adáptese al gusto)
+# (lo anterior a \endofdump se precompila en el formato del modo servidor,
+# así que no puede cargar tipografías, que XeTeX no sabe guardar en él)
 PREAMBLE = r'''\documentclass[a4paper]{article}
+\usepackage[hmargin=2.25cm, vmargin=2.5cm]{geometry}
+\usepackage{xcolor}
+\usepackage{fvextra}
+\usepackage{graphicx}
+\usepackage{booktabs}
+\usepackage{fancyhdr}
+\newcommand\ansibg[2]{{\fboxsep=0pt\colorbox#1{\strut #2}}}
+''' + LATEX_FORMATTER.get_style_defs() + r'''
+\csname endofdump\endcsname
 \usepackage{polyglossia}
 \setmainlanguage{spanish}
 \usepackage{fontspec}
@@ -377,12 +981,7 @@ PREAMBLE = r'''\documentclass[a4paper]{article}
 \setmonofont[Scale=MatchLowercase, Contextuals={AlternateOff}]{Fantasque Sans Mono}
 \usepackage{unicode-math}
 \setmathfont{XITS Math}
-\usepackage[hmargin=2.25cm, vmargin=2.5cm]{geometry}
-\usepackage{minted}
-\usepackage{graphicx}
 \usepackage[colorlinks]{hyperref}
-\usepackage{booktabs}
-\usepackage{fancyhdr}
 '''
 
 BEGIN_DOCUMENT = r'''\begin{document}
@@ -397,188 +996,1682 @@ BEGIN_DOCUMENT = r'''\begin{document}
 
 EPILOGUE = r'''\end{document}'''
 
+# Preámbulo del libro con todos los cuadernos como capítulos, que anota
+# en qué página empieza cada uno para poder dividirlo después
+BOOK_PREAMBLE = PREAMBLE.replace('{article}', '{report}', 1) + r'''\newwrite\junomarks
+\immediate\openout\junomarks=\jobname.marks
+\newcommand\junocuaderno{0}
+\AddToHook{cmd/@makechapterhead/before}{%
+	\begingroup\edef\x{\endgroup\write\junomarks{\junocuaderno\space\noexpand\the\ReadonlyShipoutCounter}}\x}
+'''
 
-def make_build_dir(filename: str, use_cache=False):
-	"""Prepara un directorio para construir el documento"""
+BOOK_BEGIN = r'''\begin{document}
+\title{Informática}
+\author{\autores}
+\date{Facultad de Ciencias Matemáticas (UCM) \\ \today \\[4em] \includegraphics[scale=0.5]{img/cc-byncsa}}
+\maketitle
+\tableofcontents
+'''
 
-	# Si la caché está activada, utiliza el subdirectorio .cache del catual
-	if use_cache:
-		build_path = os.path.join('.cache', filename.replace(os.pathsep, '_'))
-		os.makedirs(build_path, exist_ok=True)
-		return contextlib.nullcontext(build_path)
-	else:
-		return tempfile.TemporaryDirectory()
 
+class FragmentCache:
+	"""Caché en disco del LaTeX generado para cada celda Markdown"""
 
-def convert(filename: str, outname: str, interactive=False, use_cache=False) -> bool:
-	"""Convierte un cuaderno a PDF"""
+	def __init__(self, path: str):
+		self.path = path
+		os.makedirs(path, exist_ok=True)
 
-	# Carga el cuaderno de Jupyter (es un JSON)
-	with open(filename) as cfile:
-		cuaderno = json.load(cfile)
+	@staticmethod
+	def key(source: str, metadata: dict) -> str:
+		"""Clave de una celda a partir de su texto, sus metadatos y la versión del escritor"""
 
-	# Autores de los apuntes separados por comas
-	autores = ', '.join(au['name'] for au in cuaderno['metadata'].get('authors', ()))
+		digest = hashlib.sha1(f'{LaTeXWriter.VERSION}\0'.encode('ascii'))
+		digest.update(json.dumps(metadata, sort_keys=True).encode('utf-8'))
+		digest.update(b'\0')
+		digest.update(source.encode('utf-8'))
 
-	# Crea el aparseador de Markdown con soporte para LaTeX, tablas y atributos
-	md = MarkdownIt().use(texmath_plugin).use(attrs_plugin).enable('table')
+		return digest.hexdigest()
 
-	JOBNAME = 'cuaderno'  # Nombre del trabajo LaTeX
+	def get(self, key: str) -> dict | None:
+		"""Obtiene el fragmento guardado con la clave dada (si existe)"""
 
-	with make_build_dir(filename, use_cache) as tmp_dir:
-		tex_file = os.path.join(tmp_dir, f'{JOBNAME}.tex')
-		pdf_file = os.path.join(tmp_dir, f'{JOBNAME}.pdf')
+		try:
+			with open(os.path.join(self.path, f'{key}.json')) as ffile:
+				return json.load(ffile)
 
-		# Copia el símbolo de CC-BYNCSA
-		cc_img = os.path.join(tmp_dir, 'img', 'cc-byncsa.pdf')
+		except (OSError, ValueError):
+			return None
 
-		if not os.path.exists(cc_img):
-			os.makedirs(os.path.dirname(cc_img), exist_ok=True)
-			svg2pdf('img/cc-byncsa.svg', cc_img)
+	def put(self, key: str, tex: str, images: list[str], warnings: list[str] = ()):
+		"""Guarda un fragmento, las imágenes que utiliza y los avisos de su conversión"""
 
-		with open(tex_file, 'w') as tex:
-			tex.write(PREAMBLE)
-			# El LaTeXWriter recibe el parseador de Markdown porque puede
-			# necesitar hacer parseos secundarios
-			lt = LaTeXWriter(tex, md, os.path.dirname(filename), tmp_dir)
+		# Se escribe en un archivo temporal y se renombra para
+		# que otro proceso no lea nunca un fragmento incompleto
+		with atomic_file(os.path.join(self.path, f'{key}.json')) as tmp_file:
+			with open(tmp_file, 'w') as ffile:
+				json.dump({'tex': tex, 'imágenes': images, 'avisos': list(warnings)}, ffile, ensure_ascii=False)
 
-			# Intenta sacar el título del primer encabezado para ponerlo como metadato
-			if cuaderno['cells'] and (primera := cuaderno['cells'][0]['source']) and primera[0].startswith('#'):
-				título = cuaderno['cells'][0]['source'][0][2:]
-				tex.write(f'''\hypersetup{{
-					pdfauthor={{{autores}}},
-					pdftitle={{{título}}},
-					pdfsubject={{Informática FCM-UCM}},
-				}}''')
 
-			# Define los autores como un comando
-			tex.write(f'\\newcommand\\autores{{{autores}}}\n')
+def render_markdown(lt: LaTeXWriter, source: str, metadata: dict, fragments: FragmentCache | None = None) -> str:
+	"""Convierte una celda Markdown a LaTeX reutilizando el fragmento guardado si lo hay"""
 
-			tex.write(BEGIN_DOCUMENT)
+	if fragments is None and not lt.prerendered:
+		return lt.render(source, metadata)
+
+	key = FragmentCache.key(source, metadata)
+
+	# Puede haberse convertido antes en otro proceso o estar en la caché
+	if (fragment := lt.prerendered.get(key)) is None and fragments is not None:
+		if (fragment := fragments.get(key)) is not None:
+			lt.profiler.count('fragmentos reutilizados')
+
+	# En tal caso solo hay que copiar las imágenes que usa
+	if fragment is not None:
+		for src in fragment['imágenes']:
+			lt.stage_image(src)
+
+		lt.warnings.extend(fragment.get('avisos', ()))
+
+		return fragment['tex']
+
+	known = len(lt.warnings)
+	tex = lt.render(source, metadata)
+
+	if fragments is not None:
+		fragments.put(key, tex, lt.cell_images, lt.warnings[known:])
+
+	return tex
+
+
+class NotebookReader:
+	"""Lector incremental de cuadernos de Jupyter
+
+	Recorre las celdas del cuaderno una a una sin cargar todo el archivo
+	JSON en memoria. El resto de campos del cuaderno (como los metadatos)
+	están disponibles en fields después del recorrido.
+	"""
+
+	CHUNK_SIZE = 1 << 16  # tamaño mínimo de cada lectura
+	WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+	def __init__(self, filename: str):
+		self.filename = filename
+		self.fields = {}  # campos del objeto principal salvo las celdas
+
+		self.file = None  # archivo abierto durante el recorrido
+		self.buffer = ''  # texto leído y aún no consumido
+		self.pos = 0  # posición actual en el buffer
+		self.eof = False  # si se ha llegado al final del archivo
+
+	@property
+	def metadata(self) -> dict:
+		return self.fields.get('metadata', {})
+
+	def __iter__(self):
+		with open(self.filename, encoding='utf-8') as self.file:
+			self.buffer, self.pos, self.eof = '', 0, False
+
+			self.expect('{')
+
+			if self.peek() == '}':
+				return
 
-			# Recorre e imprime las celdas del cuaderno, cada una según su tipo
-			for celda in cuaderno['cells']:
-				cell_type = celda['cell_type']
-				content = ''.join(celda['source'])
-
-				# Las celdas Markdown se convierten a LaTeX sin sorpresas
-				if cell_type == 'markdown':
-					lt.process(md.parse(content), celda.get('metadata', {}))
-
-				# Y las celdas de código se copian a un entorno minted
-				elif cell_type == 'code':
-					lang = celda.get('metadata', {}).get('lang', 'python')
-					tex.write('\\begin{minted}[breaklines=true,frame=single,rulecolor=black!30]{' + lang + '}\n')
-					tex.write(content + '\n')
-					tex.write('\\end{minted}\n')
-
-				# Cada celda tiene asociada una o más salidas, que suelen ser el
-				# resultado de la ejecución del código como texto, imagen, etc.
-				has_display = any(out['output_type'] == 'display_data'
-				                  for out in celda.get('outputs', ()))
-
-				for output in celda.get('outputs', ()):
-					output_type = output['output_type']
-
-					highlight = False
-					attrs = ['breaklines=true', 'frame=single']
-
-					if has_display and output_type != 'display_data':
-						continue
-
-					# Se asume que la salida display_data es una imagen PNG
-					if output_type == 'display_data':
-						img_base = output['data']['image/png']
-						img = Image.open(io.BytesIO(base64.b64decode(img_base)))
-						# Se guarda en el directorio de construcción para que pueda cargarla LaTeX
-						src = f'img/{hashlib.sha1(img_base.encode("ascii")).hexdigest()}.jpg'
-						img.convert('L').save(os.path.join(tmp_dir, src))
-						# Se puede indicar un factor de escala en los metadatos
-						scale = celda.get('metadata', {}).get('scale', 0.5)
-						tex.write(f'\n\\begin{{center}}\\includegraphics[scale={scale}]{{{src}}}\\end{{center}}')
-						continue
-					# Resultado de la ejecución del código (un objeto Python)
-					elif output_type == 'execute_result':
-						content = ''.join(output['data']['text/plain']) + '\n'
-						highlight = True
-						attrs.append('rulecolor=green!30')
-					# Error de Python, se formatea el mensaje y la pila de llamadas
-					elif output_type == 'error':
-						content = convert_ansi(output['traceback'])
-						# Usamos ¤ como iniciador del comando porque es raro que aparezca en el texto
-						attrs += ['rulecolor=red!30', r'commandchars=¤\{\}', r'fontsize=\small']
-					# Texto impreso por pantalla
-					elif output_type == 'stream':
-						content = output['text']
-						if not content[-1].endswith('\n'):
-							content = content + ['\n']
-						attrs.append('rulecolor=blue!30')
-					# Esto no debería ocurrir
+			while True:
+				key = self.value()
+				self.expect(':')
+
+				# Las celdas se devuelven según se leen
+				if key == 'cells':
+					self.expect('[')
+
+					if self.peek() == ']':
+						self.expect(']')
 					else:
-						content = f'[Tipo de salida desconocido {output_type}]'
-						attrs.append('rulecolor=red!30')
+						while True:
+							yield self.value()
+							if self.expect(',]') == ']':
+								break
+				else:
+					self.fields[key] = self.value()
 
-					# Imprime el código con las configuraciones anteriores
-					attrs = ','.join(attrs)
-					tex.write(f'\\begin{{minted}}[{attrs}]{{python}}\n'
-					          if highlight else f'\\begin{{Verbatim}}[{attrs}]\n')
-					tex.write(''.join(content))
-					tex.write('\\end{minted}\n' if highlight else '\\end{Verbatim}\n')
+				if self.expect(',}') == '}':
+					break
 
-			tex.write(EPILOGUE)
+	def fill(self, size=None) -> bool:
+		"""Lee más texto del archivo descartando el ya consumido"""
 
-		# La salida de LaTeX no se imprime por pantalla y no se pausa cuando hay un error
-		# salvo que la opción interactive esté activada
-		if not interactive:
-			latex_args = ['-interaction', 'nonstopmode']
-			stdout_dest = subprocess.PIPE
-		else:
-			latex_args = []
-			stdout_dest = None
+		chunk = self.file.read(size or self.CHUNK_SIZE)
+		self.buffer = self.buffer[self.pos:] + chunk
+		self.pos = 0
+		self.eof = not chunk
 
-		# Llama a LaTeX con -shell-escape porque lo necesita minted
-		ret = subprocess.run([LATEX_CMD, '-shell-escape', *latex_args, f'{JOBNAME}.tex'],
-		                     cwd=tmp_dir, stdout=stdout_dest)
+		return not self.eof
 
-		if ret.returncode != 0:
-			print('Error al compilar con LaTeX:', ret.stdout.decode('utf-8'))
-		else:
-			# Podría hacer falta una segunda ejecución para referencias y demás
-			# subprocess.run([LATEX_CMD, '-shell-escape', *latex_args, tex_file],
-			#               cwd=tmp_dir, stdout=subprocess.DEVNULL)
-			# Copia el archivo fuera del directorio de construcción
-			shutil.copy(pdf_file, outname)
+	def peek(self) -> str:
+		"""Devuelve el siguiente carácter que no es un espacio"""
 
-	return True
+		while True:
+			self.pos = self.WHITESPACE.match(self.buffer, self.pos).end()
 
+			if self.pos < len(self.buffer):
+				return self.buffer[self.pos]
 
-def main():
-	import argparse
+			if not self.fill():
+				raise ValueError(f'{self.filename}: fin inesperado del archivo')
 
-	parser = argparse.ArgumentParser(description='Convierte cuadernos de Jupyter a PDF')
-	parser.add_argument('cuaderno', help='Cuaderno')
-	parser.add_argument('--interactive', '-i', help='Modo interactivo de LaTeX', action='store_true')
-	parser.add_argument('--cache', help='Usa una caché para ahorrar tiempo de compilación', action='store_true')
-	parser.add_argument('-o', help='Destino del archivo generado (si es carpeta existente, genera un archivo en ella)')
+	def expect(self, chars: str) -> str:
+		"""Consume uno de los caracteres indicados"""
 
-	args = parser.parse_args()
+		if (c := self.peek()) not in chars:
+			raise ValueError(f'{self.filename}: se esperaba {" o ".join(chars)} y aparece {c}')
 
-	# Determina el nombre del archivo de salida
-	outname = os.path.splitext(os.path.basename(args.cuaderno))[0] + '.pdf'
+		self.pos += 1
+		return c
 
-	if args.o:
-		# Si es un directorio, guarda el archivo en él
-		if os.path.isdir(args.o):
-			outname = os.path.join(args.o, outname)
-		# Si la ruta no existe y no acaba en .pdf, asume que es un directorio y lo crea
-		elif not os.path.exists(args.o) and not args.o.endswith('.pdf'):
-			os.makedirs(args.o)
-			outname = os.path.join(args.o, outname)
-		# En otro caso, guarda el archivo en la ruta indicada
-		else:
-			outname = args.o
+	def value(self):
+		"""Lee un valor JSON completo"""
+
+		self.peek()
+
+		while True:
+			try:
+				value, end = DECODER.raw_decode(self.buffer, self.pos)
+
+				# Un número al final del buffer podría continuar en el archivo
+				if end < len(self.buffer) or self.eof:
+					self.pos = end
+					return value
+
+			except json.JSONDecodeError:
+				if self.eof:
+					raise
+
+			# El valor no está completo, se lee al menos tanto como hay en
+			# el buffer para que el coste total de los reintentos sea lineal
+			self.fill(max(self.CHUNK_SIZE, len(self.buffer)))
+
+
+def make_svg_cache(use_cache=False):
+	"""Prepara un directorio para las conversiones de SVG a PDF"""
+
+	# Si la caché está activada, las conversiones se guardan entre ejecuciones
+	if use_cache:
+		svg_path = os.path.join(CACHE_DIR, 'svg')
+		os.makedirs(svg_path, exist_ok=True)
+		return contextlib.nullcontext(svg_path)
+	else:
+		return tempfile.TemporaryDirectory()
+
+
+def make_highlighter(use_cache=False) -> Highlighter:
+	"""Prepara el resaltado de código (con caché en disco si está activada)"""
+	return Highlighter(os.path.join(CACHE_DIR, 'pygments') if use_cache else None)
+
+
+def make_renderer(workers=None):
+	"""Prepara la conversión en paralelo de las celdas (si se indica el número de procesos)"""
+	return CellRenderer(workers) if workers else contextlib.nullcontext()
+
+
+def make_build_dir(filename: str, use_cache=False):
+	"""Prepara un directorio para construir el documento"""
+
+	# Si la caché está activada, utiliza el subdirectorio .cache del catual
+	if use_cache:
+		build_path = os.path.join(CACHE_DIR, os.path.relpath(filename).replace(os.sep, '_'))
+		os.makedirs(build_path, exist_ok=True)
+		return contextlib.nullcontext(build_path)
+	else:
+		return tempfile.TemporaryDirectory()
+
+
+def file_digest(path: str) -> str:
+	"""Calcula el resumen SHA1 del contenido de un archivo"""
+
+	digest = hashlib.sha1()
+
+	with open(path, 'rb') as infile:
+		while chunk := infile.read(1 << 16):
+			digest.update(chunk)
+
+	return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def template_digest(backend: str = LATEX_CMD) -> str:
+	"""Resumen de todo lo que determina el documento generado salvo el cuaderno
+
+	Incluye el propio juno.py, así que cualquier cambio en la conversión
+	invalida los PDF guardados en la caché.
+	"""
+
+	digest = hashlib.sha1()
+
+	for part in (VERSION, str(LaTeXWriter.VERSION), file_digest(__file__), backend, PREAMBLE, BEGIN_DOCUMENT, EPILOGUE):
+		digest.update(part.encode('utf-8'))
+		digest.update(b'\0')
+
+	return digest.hexdigest()
+
+
+def read_manifest(build_dir: str) -> dict | None:
+	"""Lee el manifiesto de la compilación guardada en la caché (si la hay)"""
+
+	try:
+		with open(os.path.join(build_dir, MANIFEST)) as mfile:
+			return json.load(mfile)
+
+	except (OSError, ValueError):
+		return None
+
+
+def write_manifest(build_dir: str, filename: str, images, backend: str = LATEX_CMD):
+	"""Guarda el manifiesto de una compilación correcta en la caché"""
+
+	manifest = {
+		'plantilla': template_digest(backend),
+		'cuaderno': file_digest(filename),
+		'imágenes': {path: file_digest(path) for path in sorted(images)},
+	}
+
+	with open(os.path.join(build_dir, MANIFEST), 'w') as mfile:
+		json.dump(manifest, mfile, indent=1, ensure_ascii=False)
+
+
+def is_up_to_date(build_dir: str, filename: str, backend: str = LATEX_CMD) -> bool:
+	"""Comprueba si el PDF guardado en la caché corresponde al cuaderno actual"""
+
+	if (manifest := read_manifest(build_dir)) is None:
+		return False
+
+	if not os.path.exists(os.path.join(build_dir, f'{JOBNAME}.pdf')):
+		return False
+
+	try:
+		return (manifest.get('plantilla') == template_digest(backend)
+		        and manifest.get('cuaderno') == file_digest(filename)
+		        and all(file_digest(path) == digest
+		                for path, digest in manifest.get('imágenes', {}).items()))
+
+	# Alguna de las imágenes ya no existe
+	except OSError:
+		return False
+
+
+def make_markdown():
+	"""Crea el parseador de Markdown con soporte para LaTeX, tablas y atributos"""
+	return MarkdownIt().use(texmath_plugin).use(attrs_plugin).enable('table')
+
+
+def save_grayscale(img_base: str, target_file: str, link_to: str | None = None):
+	"""Guarda una imagen PNG en base64 como JPEG en escala de grises
+
+	Si se indica link_to, se enlaza allí también la imagen convertida.
+	"""
+
+	img = Image.open(io.BytesIO(base64.b64decode(img_base)))
+
+	# Se escribe con otro nombre y se renombra para que una conversión
+	# interrumpida no deje un archivo incompleto en la caché
+	with atomic_file(target_file) as tmp_file:
+		img.convert('L').save(tmp_file, format='JPEG')
+
+	if link_to is not None:
+		link_file(target_file, link_to)
+
+
+class ImageStage:
+	"""Conversión en paralelo de las imágenes de las salidas de las celdas
+
+	Si se indica un almacén, las imágenes convertidas se guardan en él
+	y se enlazan desde el directorio de construcción, de modo que cada
+	imagen se convierte una sola vez para todos los cuadernos.
+	"""
+
+	def __init__(self, build_dir: str, workers=None, profiler: Profiler | None = None, store: str | None = None):
+		self.build_dir = build_dir
+		self.workers = workers
+		self.profiler = profiler or Profiler('')
+		self.store = store  # almacén de imágenes convertidas (si lo hay)
+		self.pool = None
+		self.pending = {}  # conversiones en curso por nombre de archivo
+		self.used = set()  # nombres de las imágenes usadas por el documento
+
+	def __enter__(self):
+		os.makedirs(os.path.join(self.build_dir, 'img'), exist_ok=True)
+
+		if self.store is not None:
+			os.makedirs(self.store, exist_ok=True)
+
+		self.pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+		return self
+
+	def __exit__(self, *args):
+		# Se mide el tiempo de espera por las conversiones que aún no han terminado
+		with self.profiler.stage('imágenes'):
+			self.pool.shutdown(cancel_futures=args[0] is not None)
+
+		self.profiler.count('imágenes convertidas', len(self.pending))
+
+		# Propaga los errores de conversión (salvo que ya haya otro)
+		if args[0] is None:
+			for future in self.pending.values():
+				future.result()
+
+		# Anota qué imágenes del almacén se usan para que --gc no las borre
+		if self.store is not None:
+			with open(os.path.join(self.build_dir, ASSET_MANIFEST), 'w') as afile:
+				json.dump(sorted(self.used), afile, indent=1)
+
+	def submit(self, img_base: str) -> str:
+		"""Encarga la conversión de una imagen y devuelve su nombre en el directorio de construcción"""
+
+		# El nombre es el resumen del contenido, así que si el archivo ya
+		# existe (de una compilación anterior) no hay que convertirlo
+		name = f'{hashlib.sha1(img_base.encode("ascii")).hexdigest()}.jpg'
+		src = f'img/{name}'
+		target_file = os.path.join(self.build_dir, src)
+
+		if name in self.used:
+			return src
+
+		self.used.add(name)
+
+		if os.path.exists(target_file):
+			return src
+
+		# Si ya está en el almacén basta con enlazarla
+		if self.store is not None:
+			stored_file = os.path.join(self.store, name)
+
+			if os.path.exists(stored_file):
+				link_file(stored_file, target_file)
+			else:
+				self.pending[src] = self.pool.submit(save_grayscale, img_base, stored_file, target_file)
+		else:
+			self.pending[src] = self.pool.submit(save_grayscale, img_base, target_file)
+
+		return src
+
+
+def make_asset_store(use_cache=False) -> str | None:
+	"""Almacén de imágenes de las salidas (solo si la caché está activada)"""
+	return ASSET_DIR if use_cache else None
+
+
+def collect_garbage() -> int:
+	"""Borra del almacén las imágenes que no usa ningún directorio de construcción"""
+
+	used = set()
+
+	for entry in os.scandir(CACHE_DIR) if os.path.isdir(CACHE_DIR) else ():
+		try:
+			with open(os.path.join(entry.path, ASSET_MANIFEST)) as afile:
+				names = set(json.load(afile))
+		except (OSError, ValueError):
+			continue
+
+		used |= names
+
+		# También se quitan los enlaces a imágenes del almacén que el documento
+		# ya no usa (no las de las celdas Markdown, que son enlaces simbólicos)
+		with contextlib.suppress(OSError):
+			for image in os.scandir(os.path.join(entry.path, 'img')):
+				if (re.fullmatch(r'[0-9a-f]{40}\.jpg', image.name) and image.name not in names
+				   and not image.is_symlink()):
+					os.unlink(image.path)
+
+	removed, freed = 0, 0
+
+	with contextlib.suppress(FileNotFoundError):
+		for asset in os.scandir(ASSET_DIR):
+			if asset.name not in used:
+				freed += asset.stat().st_size
+				os.unlink(asset.path)
+				removed += 1
+
+	print(f'Se han borrado {removed} imágenes del almacén ({freed / 1e6:.1f} MB)')
+
+	return 0
+
+
+def render_cell(lt: LaTeXWriter, celda: dict, images: ImageStage,
+                fragments: FragmentCache | None = None) -> list[str]:
+	"""Genera los fragmentos de LaTeX de una celda del cuaderno"""
+
+	tex = []
+	cell_type = celda['cell_type']
+	content = ''.join(celda['source'])
+
+	# Las celdas Markdown se convierten a LaTeX sin sorpresas
+	if cell_type == 'markdown':
+		tex.append(render_markdown(lt, content, celda.get('metadata', {}), fragments))
+
+	# Y las celdas de código se copian resaltadas a un entorno Verbatim
+	elif cell_type == 'code':
+		lang = celda.get('metadata', {}).get('lang', 'python')
+		tex.append(f'\\begin{{Verbatim}}[{HIGHLIGHT_ATTRS},breaklines=true,frame=single,rulecolor=black!30]\n')
+		tex.append(lt.highlighter.block(content, lang))
+		tex.append('\\end{Verbatim}\n')
+
+	# Cada celda tiene asociada una o más salidas, que suelen ser el
+	# resultado de la ejecución del código como texto, imagen, etc.
+	has_display = any(out['output_type'] == 'display_data'
+	                  for out in celda.get('outputs', ()))
+
+	for output in celda.get('outputs', ()):
+		output_type = output['output_type']
+
+		attrs = ['breaklines=true', 'frame=single']
+
+		if has_display and output_type != 'display_data':
+			continue
+
+		# Se asume que la salida display_data es una imagen PNG
+		if output_type == 'display_data':
+			# Se guarda en el directorio de construcción para que pueda cargarla LaTeX
+			# (la conversión se hace en segundo plano mientras se escribe el documento)
+			src = images.submit(output['data']['image/png'])
+			# Se puede indicar un factor de escala en los metadatos
+			scale = celda.get('metadata', {}).get('scale', 0.5)
+			tex.append(f'\n\\begin{{center}}\\includegraphics[scale={scale}]{{{src}}}\\end{{center}}')
+			continue
+		# Resultado de la ejecución del código (un objeto Python)
+		elif output_type == 'execute_result':
+			content = lt.highlighter.block(''.join(output['data']['text/plain']) + '\n', 'python')
+			attrs += ['rulecolor=green!30', HIGHLIGHT_ATTRS]
+		# Error de Python, se formatea el mensaje y la pila de llamadas
+		elif output_type == 'error':
+			content = convert_ansi(output['traceback'])
+			# Usamos ¤ como iniciador del comando porque es raro que aparezca en el texto
+			attrs += ['rulecolor=red!30', r'commandchars=¤\{\}', r'fontsize=\small']
+		# Texto impreso por pantalla
+		elif output_type == 'stream':
+			content = output['text']
+			if not content[-1].endswith('\n'):
+				content = content + ['\n']
+			attrs.append('rulecolor=blue!30')
+		# Esto no debería ocurrir
+		else:
+			content = f'[Tipo de salida desconocido {output_type}]'
+			attrs.append('rulecolor=red!30')
+
+		# Imprime el código con las configuraciones anteriores
+		attrs = ','.join(attrs)
+		tex.append(f'\\begin{{Verbatim}}[{attrs}]\n')
+		tex.append(''.join(content))
+		tex.append('\\end{Verbatim}\n')
+
+	return tex
+
+
+def code_snippets(filename: str):
+	"""Código de las celdas y resultados de un cuaderno con su lenguaje"""
+
+	for celda in NotebookReader(filename):
+		if celda['cell_type'] == 'code':
+			yield ''.join(celda['source']), celda.get('metadata', {}).get('lang', 'python')
+
+			for output in celda.get('outputs', ()):
+				if output['output_type'] == 'execute_result':
+					yield ''.join(output['data']['text/plain']) + '\n', 'python'
+
+
+def markdown_cells(filename: str):
+	"""Texto y metadatos de las celdas Markdown de un cuaderno"""
+
+	for celda in NotebookReader(filename):
+		if celda['cell_type'] == 'markdown':
+			yield ''.join(celda['source']), celda.get('metadata', {})
+
+
+class PlannedAssets:
+	"""Nombres de las imágenes en el directorio de construcción sin prepararlas
+
+	Lo usan los procesos auxiliares de CellRenderer, ya que las imágenes
+	se preparan después en el proceso principal.
+	"""
+
+	def require(self, source_file: str, target_file: str) -> str:
+		return target_file[:-3] + 'pdf' if source_file.endswith('.svg') else target_file
+
+
+@functools.lru_cache(maxsize=8)
+def worker_writer(source_dir: str, build_dir: str, highlight_dir: str | None, book: bool) -> LaTeXWriter:
+	"""Escritor de un proceso auxiliar (se reutiliza para las celdas del mismo cuaderno)"""
+
+	lt = LaTeXWriter(None, make_markdown(), source_dir, build_dir, PlannedAssets(), Highlighter(highlight_dir))
+	lt.book = book
+
+	return lt
+
+
+def render_in_worker(source_dir: str, build_dir: str, highlight_dir: str | None, book: bool,
+                     source: str, metadata: dict) -> dict:
+	"""Convierte una celda Markdown en un proceso auxiliar"""
+
+	# Listas nuevas en cada celda, ya que los resultados de un mismo
+	# lote no se serializan hasta que se han convertido todas sus celdas
+	lt = worker_writer(source_dir, build_dir, highlight_dir, book)
+	lt.warnings = []
+
+	tex = lt.render(source, metadata)
+
+	return {'tex': tex, 'imágenes': lt.cell_images, 'avisos': lt.warnings}
+
+
+class CellRenderer:
+	"""Conversión de las celdas Markdown de los cuadernos en varios procesos
+
+	Las celdas son independientes entre sí salvo por las imágenes que
+	incluyen y los avisos del escritor, que se trasladan al proceso principal
+	cuando se escribe cada celda (véase render_markdown).
+	"""
+
+	def __init__(self, workers=None):
+		self.workers = workers  # número de procesos
+		self.pool = None  # se arranca solo si hay suficientes celdas
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		if self.pool is not None:
+			self.pool.shutdown(cancel_futures=args[0] is not None)
+
+	def prerender(self, lt: LaTeXWriter, cells, fragments: FragmentCache | None = None):
+		"""Convierte en paralelo las celdas que no estén en la caché"""
+
+		missing = {}
+
+		for source, metadata in cells:
+			if (key := FragmentCache.key(source, metadata)) not in missing and \
+			   (fragments is None or fragments.get(key) is None):
+				missing[key] = (source, metadata)
+
+		# Con pocas celdas no compensa repartirlas
+		if len(missing) < PARALLEL_RENDER:
+			return
+
+		if self.pool is None:
+			self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+
+		n = len(missing)
+		sources, metadatas = zip(*missing.values())
+		results = self.pool.map(render_in_worker, [lt.source_dir] * n, [lt.build_dir] * n,
+		                        [lt.highlighter.cache_dir] * n, [lt.book] * n, sources, metadatas, chunksize=8)
+
+		for key, fragment in zip(missing, results):
+			lt.prerendered[key] = fragment
+
+			if fragments is not None:
+				fragments.put(key, fragment['tex'], fragment['imágenes'], fragment['avisos'])
+
+		lt.profiler.count('celdas en paralelo', n)
+
+
+def emit_cells(filename: str, body, lt: LaTeXWriter, images: ImageStage, fragments: FragmentCache | None,
+               profiler: Profiler, renderer: CellRenderer | None = None) -> tuple[str | None, list[str]]:
+	"""Escribe en body el LaTeX de las celdas de un cuaderno
+
+	Devuelve el título del cuaderno (su primer encabezado) y sus autores.
+	"""
+
+	lt.source_dir = os.path.dirname(filename)
+
+	# Se resaltan de una vez las celdas de código (el resto se resalta según aparece)
+	with profiler.stage('resaltado'):
+		lt.highlighter.prefetch(code_snippets(filename))
+
+	if renderer is not None:
+		with profiler.stage('markdown'):
+			renderer.prerender(lt, markdown_cells(filename), fragments)
+
+	# El cuaderno de Jupyter (es un JSON) se lee celda a celda
+	cuaderno = NotebookReader(filename)
+	título = None
+
+	# Recorre e imprime las celdas del cuaderno, cada una según su tipo
+	for k, celda in enumerate(profiler.timed(cuaderno, 'lectura')):
+		# Intenta sacar el título del primer encabezado para ponerlo como metadato
+		if k == 0 and (primera := celda['source']) and primera[0].startswith('#'):
+			título = primera[0][2:]
+
+		start = time.perf_counter()
+		body.writelines(render_cell(lt, celda, images, fragments))
+		profiler.cell(k, celda['cell_type'], time.perf_counter() - start)
+
+	for warning in lt.warnings:
+		print(f'Aviso en {filename}: {warning}')
+
+	lt.warnings.clear()
+
+	# Los metadatos con los autores están tras las celdas en el JSON
+	return título, [au['name'] for au in cuaderno.metadata.get('authors', ())]
+
+
+def emit_tex(filename: str, build_dir: str, md: MarkdownIt, svg: SvgConverter, highlighter: Highlighter,
+             fragments: FragmentCache | None = None, profiler: Profiler | None = None,
+             renderer: CellRenderer | None = None, asset_store: str | None = None) -> set[str]:
+	"""Genera el documento LaTeX de un cuaderno en el directorio de construcción
+
+	Devuelve los archivos de imagen de los que depende el documento. Las
+	imágenes SVG desactualizadas quedan pendientes de conversión en svg.
+	Con renderer, las celdas Markdown se convierten antes en paralelo.
+	"""
+
+	tex_file = os.path.join(build_dir, f'{JOBNAME}.tex')
+
+	# Copia el símbolo de CC-BYNCSA
+	assets = AssetTracker(svg)
+	assets.require('img/cc-byncsa.svg', os.path.join(build_dir, 'img', 'cc-byncsa.svg'))
+
+	if profiler is None:
+		profiler = Profiler(filename)
+
+	# Los metadatos con los autores están tras las celdas en el JSON, así que el
+	# cuerpo del documento se escribe antes en un archivo temporal
+	with tempfile.TemporaryFile('w+', dir=build_dir) as body, \
+	     ImageStage(build_dir, profiler=profiler, store=asset_store) as images:
+		# El LaTeXWriter recibe el parseador de Markdown porque puede
+		# necesitar hacer parseos secundarios
+		lt = LaTeXWriter(body, md, os.path.dirname(filename), build_dir, assets, highlighter)
+		lt.profiler = profiler
+
+		título, autores = emit_cells(filename, body, lt, images, fragments, profiler, renderer)
+
+		# Autores de los apuntes separados por comas
+		autores = ', '.join(autores)
+
+		with open(tex_file, 'w') as tex:
+			tex.write(PREAMBLE)
+
+			if título is not None:
+				tex.write(f'''\hypersetup{{
+					pdfauthor={{{autores}}},
+					pdftitle={{{título}}},
+					pdfsubject={{Informática FCM-UCM}},
+				}}''')
+
+			# Define los autores como un comando
+			tex.write(f'\\newcommand\\autores{{{autores}}}\n')
+
+			tex.write(BEGIN_DOCUMENT)
+
+			body.seek(0)
+			shutil.copyfileobj(body, tex)
+
+			tex.write(EPILOGUE)
+
+	# Las dependencias se guardan aunque luego falle la compilación
+	# para que el modo de vigilancia sepa qué imágenes usa el cuaderno
+	with open(os.path.join(build_dir, DEPENDENCIES), 'w') as dfile:
+		json.dump(sorted(assets.sources), dfile, indent=1, ensure_ascii=False)
+
+	return set(assets.sources)
+
+
+def emit_book(filenames: list[str], build_dir: str, md: MarkdownIt, svg: SvgConverter, highlighter: Highlighter,
+              fragments: FragmentCache | None = None, profiler: Profiler | None = None,
+              renderer: CellRenderer | None = None, asset_store: str | None = None) -> set[str]:
+	"""Genera un libro con los cuadernos como capítulos en el directorio de construcción
+
+	Los cuadernos comparten el preámbulo, el índice y las imágenes, que se
+	incluyen una sola vez en el directorio de construcción.
+	"""
+
+	tex_file = os.path.join(build_dir, f'{JOBNAME}.tex')
+
+	assets = AssetTracker(svg)
+	assets.require('img/cc-byncsa.svg', os.path.join(build_dir, 'img', 'cc-byncsa.svg'))
+
+	if profiler is None:
+		profiler = Profiler('libro')
+
+	with tempfile.TemporaryFile('w+', dir=build_dir) as body, \
+	     ImageStage(build_dir, profiler=profiler, store=asset_store) as images:
+		lt = LaTeXWriter(body, md, '.', build_dir, assets, highlighter)
+		lt.profiler = profiler
+		lt.book = True
+
+		autores = {}  # autores de todos los cuadernos sin repetir (en orden)
+
+		for k, filename in enumerate(filenames, start=1):
+			# Los capítulos que empiecen a partir de aquí son de este cuaderno
+			body.write(f'\\renewcommand\\junocuaderno{{{k}}}\n')
+
+			título, nb_autores = emit_cells(filename, body, lt, images, fragments, profiler, renderer)
+			autores.update(dict.fromkeys(nb_autores))
+
+			if título is None:
+				print(f'Aviso: {filename} no empieza con un título, así que no será un capítulo')
+
+			body.write('\n')
+
+		autores = ', '.join(autores)
+
+		with open(tex_file, 'w') as tex:
+			tex.write(BOOK_PREAMBLE)
+			tex.write(f'''\\hypersetup{{
+				pdfauthor={{{autores}}},
+				pdftitle={{Informática}},
+				pdfsubject={{Informática FCM-UCM}},
+			}}''')
+			tex.write(f'\\newcommand\\autores{{{autores}}}\n')
+			tex.write(BOOK_BEGIN)
+
+			body.seek(0)
+			shutil.copyfileobj(body, tex)
+
+			tex.write(EPILOGUE)
+
+	return set(assets.sources)
+
+
+def split_book(build_dir: str, filenames: list[str], dest: str) -> bool:
+	"""Divide el PDF del libro en un PDF por cuaderno con qpdf"""
+
+	if shutil.which('qpdf') is None:
+		print('No se puede dividir el libro sin qpdf')
+		return False
+
+	# Primera página de cada cuaderno según las anotaciones de LaTeX
+	starts = {}
+
+	with contextlib.suppress(OSError):
+		with open(os.path.join(build_dir, f'{JOBNAME}.marks')) as mfile:
+			for line in mfile:
+				k, page = map(int, line.split())
+				starts.setdefault(k, page)
+
+	if missing := [filename for k, filename in enumerate(filenames, start=1) if k not in starts]:
+		print('No se sabe dónde empiezan en el libro', ', '.join(missing))
+		return False
+
+	pdf_file = os.path.join(build_dir, f'{JOBNAME}.pdf')
+	pages = [starts[k] for k in range(1, len(filenames) + 1)]
+	ok = True
+
+	for filename, start, end in zip(filenames, pages, [page - 1 for page in pages[1:]] + ['z']):
+		ret = subprocess.run(['qpdf', pdf_file, '--pages', pdf_file, f'{start}-{end}', '--',
+		                      output_name(filename, dest, batch=True)])
+		# qpdf termina con 3 si solo hay avisos
+		ok = ok and ret.returncode in (0, 3)
+
+	return ok
+
+
+def build_format(command: str = LATEX_CMD) -> str | None:
+	"""Precompila el preámbulo en un formato de LaTeX con mylatexformat
+
+	Devuelve la ruta del formato (sin extensión) o None si no se ha podido
+	generar. El nombre del formato depende del preámbulo, así que solo se
+	vuelve a generar cuando este cambia.
+	"""
+
+	fmt_dir = os.path.abspath(os.path.join(CACHE_DIR, 'formato'))
+	name = 'juno-' + hashlib.sha1(f'{command}\0{PREAMBLE}'.encode('utf-8')).hexdigest()[:16]
+
+	if os.path.exists(os.path.join(fmt_dir, f'{name}.fmt')):
+		return os.path.join(fmt_dir, name)
+
+	os.makedirs(fmt_dir, exist_ok=True)
+
+	# mylatexformat lee el preámbulo de un documento hasta \endofdump
+	with open(os.path.join(fmt_dir, f'{name}.tex'), 'w') as tex:
+		tex.write(PREAMBLE)
+		tex.write('\\begin{document}\\end{document}\n')
+
+	ret = subprocess.run([command, '-ini', '-interaction', 'nonstopmode',
+	                      f'-jobname={name}', f'&{command}', 'mylatexformat.ltx', f'{name}.tex'],
+	                     cwd=fmt_dir, stdout=subprocess.PIPE)
+
+	if ret.returncode != 0:
+		print('Error al generar el formato precompilado:', ret.stdout.decode('utf-8', errors='replace'))
+		return None
+
+	return os.path.join(fmt_dir, name)
+
+
+def aux_digest(build_dir: str) -> str | None:
+	"""Resumen de los archivos .aux y .toc del documento (None si no existe el .aux)"""
+
+	try:
+		digest = file_digest(os.path.join(build_dir, f'{JOBNAME}.aux'))
+	except OSError:
+		return None
+
+	with contextlib.suppress(OSError):
+		digest += file_digest(os.path.join(build_dir, f'{JOBNAME}.toc'))
+
+	return digest
+
+
+class LatexBackend:
+	"""Compilador del documento LaTeX de un directorio de construcción"""
+
+	name = 'latex'  # nombre para la opción --backend
+	command = 'latex'  # programa que se ejecuta
+	max_runs = MAX_RUNS  # ejecuciones como máximo (1 si el programa ya repite)
+	formats = False  # si admite el formato precompilado de mylatexformat
+
+	def arguments(self, interactive: bool, fmt: str | None) -> list[str]:
+		# La salida de LaTeX no se pausa cuando hay un error salvo
+		# que la opción interactive esté activada
+		args = [] if interactive else ['-interaction', 'nonstopmode']
+
+		if fmt is not None:
+			args.append(f'-fmt={os.path.basename(fmt)}')
+
+		return args
+
+	def run(self, build_dir: str, interactive: bool, fmt: str | None) -> subprocess.CompletedProcess:
+		"""Ejecuta una vez el compilador"""
+
+		env = None
+
+		# El formato se busca en su directorio además de en los habituales
+		if fmt is not None:
+			env = dict(os.environ, TEXFORMATS=os.path.dirname(fmt) + os.pathsep + os.environ.get('TEXFORMATS', ''))
+
+		# La salida de LaTeX no se imprime por pantalla salvo en modo interactivo
+		# (el código ya viene resaltado, así que no necesita -shell-escape)
+		return subprocess.run([self.command, *self.arguments(interactive, fmt), f'{JOBNAME}.tex'],
+		                      cwd=build_dir, stdout=None if interactive else subprocess.PIPE, env=env)
+
+	def wants_rerun(self, build_dir: str) -> bool:
+		"""Si LaTeX pide otra ejecución en el registro o hay un índice por componer"""
+
+		if os.path.exists(os.path.join(build_dir, f'{JOBNAME}.toc')):
+			return True
+
+		try:
+			with open(os.path.join(build_dir, f'{JOBNAME}.log'), errors='replace') as logfile:
+				log = logfile.read()
+		except OSError:
+			return False
+
+		return 'Rerun to get' in log or 'may have changed' in log
+
+	def compile(self, build_dir: str, interactive=False, fmt=None,
+	            profiler: Profiler | None = None) -> tuple[bool, str]:
+		"""Compila el documento hasta que el archivo .aux no cambie"""
+
+		if not self.formats:
+			fmt = None
+
+		if profiler is None:
+			profiler = Profiler(build_dir)
+
+		previous, log = aux_digest(build_dir), ''
+
+		for _ in range(self.max_runs):
+			with profiler.stage('latex'):
+				ret = self.run(build_dir, interactive, fmt)
+
+			profiler.count('procesos')
+
+			log = ret.stdout.decode('utf-8', errors='replace') if ret.stdout else ''
+
+			if ret.returncode != 0:
+				return False, log
+
+			# Solo se repite si ha cambiado el .aux o el índice, y si no
+			# había uno anterior, solo si LaTeX lo pide o hay índice
+			current = aux_digest(build_dir)
+
+			if current == previous or (previous is None and not self.wants_rerun(build_dir)):
+				break
+
+			previous = current
+
+		return True, log
+
+
+class XeLaTeX(LatexBackend):
+	name = command = 'xelatex'
+	formats = True
+
+
+class LuaLaTeX(LatexBackend):
+	name = command = 'lualatex'
+
+
+class Latexmk(LatexBackend):
+	"""latexmk decide por sí mismo cuántas veces ejecutar XeLaTeX"""
+
+	name = command = 'latexmk'
+	max_runs = 1
+
+	def arguments(self, interactive: bool, fmt: str | None) -> list[str]:
+		return ['-xelatex', *([] if interactive else ['-interaction=nonstopmode'])]
+
+
+class Tectonic(LatexBackend):
+	"""Tectonic repite la compilación hasta que converge y nunca es interactivo"""
+
+	name = command = 'tectonic'
+	max_runs = 1
+
+	def arguments(self, interactive: bool, fmt: str | None) -> list[str]:
+		return ['--keep-logs']
+
+
+class StubLatex(LatexBackend):
+	"""Sustituto de LaTeX para pruebas que escribe un PDF vacío sin lanzar procesos"""
+
+	name = 'stub'
+	command = None
+
+	PDF = (b'%PDF-1.4\n1 0 obj <</Type /Catalog /Pages 2 0 R>> endobj\n'
+	       b'2 0 obj <</Type /Pages /Kids [3 0 R] /Count 1>> endobj\n'
+	       b'3 0 obj <</Type /Page /Parent 2 0 R /MediaBox [0 0 595 842]>> endobj\n'
+	       b'trailer <</Root 1 0 R>>\n%%EOF\n')
+
+	def compile(self, build_dir: str, interactive=False, fmt=None,
+	            profiler: Profiler | None = None) -> tuple[bool, str]:
+		if not os.path.exists(os.path.join(build_dir, f'{JOBNAME}.tex')):
+			return False, f'No existe {JOBNAME}.tex'
+
+		with open(os.path.join(build_dir, f'{JOBNAME}.pdf'), 'wb') as pdf:
+			pdf.write(self.PDF)
+
+		return True, ''
+
+
+# Compiladores disponibles por nombre
+BACKENDS = {backend.name: backend for backend in (XeLaTeX(), LuaLaTeX(), Latexmk(), Tectonic(), StubLatex())}
+
+
+def export_tex(build_dir: str, outname: str) -> str:
+	"""Copia el documento LaTeX y sus imágenes a un directorio junto a outname
+
+	El directorio se llama como outname sin extensión y el documento como el
+	directorio, de modo que se puede compilar en otro lugar. Devuelve su ruta.
+	"""
+
+	out_dir = os.path.splitext(outname)[0]
+	os.makedirs(out_dir, exist_ok=True)
+
+	shutil.copy(os.path.join(build_dir, f'{JOBNAME}.tex'),
+	            os.path.join(out_dir, os.path.basename(out_dir) + '.tex'))
+
+	# Las imágenes son enlaces a la caché o a los originales, que se copian
+	if os.path.isdir(img_dir := os.path.join(build_dir, 'img')):
+		shutil.copytree(img_dir, os.path.join(out_dir, 'img'), dirs_exist_ok=True)
+
+	return out_dir
+
+
+def convert(filename: str, outname: str, interactive=False, use_cache=False, md=None, fmt=None,
+            profiler: Profiler | None = None, backend: LatexBackend | None = None, tex_only=False,
+            render_workers=None) -> bool:
+	"""Convierte un cuaderno a PDF (o solo a LaTeX si tex_only)
+
+	Si se indica render_workers, las celdas Markdown se convierten en
+	paralelo con ese número de procesos.
+	"""
+
+	if md is None:
+		md = make_markdown()
+
+	if backend is None:
+		backend = BACKENDS[LATEX_CMD]
+
+	if profiler is None:
+		profiler = Profiler(filename)
+
+	# El LaTeX de las celdas Markdown se guarda en la caché para no regenerarlo
+	fragments = FragmentCache(os.path.join(CACHE_DIR, 'fragmentos')) if use_cache else None
+
+	with make_build_dir(filename, use_cache) as tmp_dir, make_svg_cache(use_cache) as svg_dir, \
+	     make_renderer(render_workers) as renderer:
+		# Si nada ha cambiado desde la última compilación se copia el PDF guardado
+		with profiler.stage('caché'):
+			up_to_date = use_cache and is_up_to_date(tmp_dir, filename, backend.name)
+
+		if up_to_date:
+			if tex_only:
+				export_tex(tmp_dir, outname)
+			else:
+				shutil.copy(os.path.join(tmp_dir, f'{JOBNAME}.pdf'), outname)
+			profiler.finish()
+			return True
+
+		svg = SvgConverter(svg_dir)
+		images = emit_tex(filename, tmp_dir, md, svg, make_highlighter(use_cache), fragments, profiler, renderer,
+		                  make_asset_store(use_cache))
+
+		# Sin sus imágenes el documento no se puede compilar
+		if svg.run(profiler):
+			profiler.finish()
+			return False
+
+		# Sin compilar, se copian el documento y sus imágenes
+		if tex_only:
+			export_tex(tmp_dir, outname)
+			profiler.finish()
+			return True
+
+		ok, log = backend.compile(tmp_dir, interactive, fmt, profiler)
+
+		if not ok:
+			print('Error al compilar con LaTeX:', log)
+		else:
+			# Copia el archivo fuera del directorio de construcción
+			shutil.copy(os.path.join(tmp_dir, f'{JOBNAME}.pdf'), outname)
+
+			if use_cache:
+				write_manifest(tmp_dir, filename, images, backend.name)
+
+	profiler.finish()
+
+	return ok
+
+
+def convert_many(jobs: list[tuple[str, str]], use_cache=False, workers=None, md=None, fmt=None,
+                 profilers: dict | None = None, backend: LatexBackend | None = None,
+                 tex_only=False, render_workers=None) -> dict[str, bool]:
+	"""Convierte varios cuadernos a PDF compilándolos en paralelo
+
+	Si se pasa un diccionario en profilers, se rellena con las mediciones
+	de cada cuaderno (y de las fases comunes a todos con la clave None).
+	Con tex_only solo se generan los documentos LaTeX.
+	"""
+
+	if backend is None:
+		backend = BACKENDS[LATEX_CMD]
+
+	if profilers is None:
+		profilers = {}
+
+	profilers[None] = batch_profiler = Profiler('(lote)')
+
+	# El parseador de Markdown y la caché de fragmentos se comparten entre todos los cuadernos
+	if md is None:
+		md = make_markdown()
+
+	fragments = FragmentCache(os.path.join(CACHE_DIR, 'fragmentos')) if use_cache else None
+	results = {}
+
+	with contextlib.ExitStack() as stack:
+		# Las conversiones de SVG y el resaltado se comparten entre todos los cuadernos
+		svg = SvgConverter(stack.enter_context(make_svg_cache(use_cache)))
+		highlighter = make_highlighter(use_cache)
+		renderer = stack.enter_context(make_renderer(render_workers))
+
+		# Primero se generan todos los documentos LaTeX en este proceso
+		pending = []
+
+		for filename, outname in jobs:
+			build_dir = stack.enter_context(make_build_dir(filename, use_cache))
+			profilers[filename] = profiler = Profiler(filename)
+
+			# Los cuadernos que no han cambiado no se vuelven a compilar
+			with profiler.stage('caché'):
+				up_to_date = use_cache and is_up_to_date(build_dir, filename, backend.name)
+
+			if up_to_date:
+				if tex_only:
+					export_tex(build_dir, outname)
+				else:
+					shutil.copy(os.path.join(build_dir, f'{JOBNAME}.pdf'), outname)
+				results[filename] = True
+				profiler.finish()
+				continue
+
+			try:
+				images = emit_tex(filename, build_dir, md, svg, highlighter, fragments, profiler, renderer,
+				                  make_asset_store(use_cache))
+				pending.append((filename, outname, build_dir, images))
+
+			except (OSError, ValueError, KeyError) as e:
+				print(f'Error al generar el LaTeX de {filename}: {e}')
+				results[filename] = False
+
+		# Se convierten a la vez las imágenes SVG de todos los cuadernos y
+		# fallan solo los cuadernos que usan las que no se han podido convertir
+		if failed := svg.run(batch_profiler):
+			for filename, _, _, images in pending:
+				if images & failed:
+					results[filename] = False
+					profilers[filename].finish()
+
+			pending = [job for job in pending if job[0] not in results]
+
+		if tex_only:
+			for filename, outname, build_dir, _ in pending:
+				export_tex(build_dir, outname)
+				results[filename] = True
+				profilers[filename].finish()
+
+			pending = []
+
+		# Luego se compilan en paralelo (cada compilación es un proceso
+		# externo, así que basta con hilos para repartirlas entre los núcleos)
+		with concurrent.futures.ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+			futures = {pool.submit(backend.compile, build_dir, False, fmt, profilers[filename]):
+			           (filename, outname, build_dir, images)
+			           for filename, outname, build_dir, images in pending}
+
+			for future in concurrent.futures.as_completed(futures):
+				filename, outname, build_dir, images = futures[future]
+				ok, log = future.result()
+
+				if ok:
+					shutil.copy(os.path.join(build_dir, f'{JOBNAME}.pdf'), outname)
+
+					if use_cache:
+						write_manifest(build_dir, filename, images, backend.name)
+				else:
+					print(f'Error al compilar {filename} con LaTeX:', log)
+
+				results[filename] = ok
+				profilers[filename].finish()
+
+	batch_profiler.finish()
+
+	# Resumen del resultado de cada cuaderno (en el orden de entrada)
+	for filename, _ in jobs:
+		print(f'{"✓" if results[filename] else "✗"} {filename}')
+
+	return results
+
+
+def convert_book(filenames: list[str], outname: str, interactive=False, use_cache=False,
+                 profiler: Profiler | None = None, backend: LatexBackend | None = None, tex_only=False,
+                 render_workers=None, split: str | None = None) -> bool:
+	"""Convierte varios cuadernos a un único PDF con un capítulo por cuaderno
+
+	Si se indica un directorio en split, el libro se divide después
+	en un PDF por cuaderno que se guarda en él.
+	"""
+
+	if backend is None:
+		backend = BACKENDS[LATEX_CMD]
+
+	if profiler is None:
+		profiler = Profiler('libro')
+
+	# Los fragmentos de los libros son distintos, porque los títulos son capítulos
+	fragments = FragmentCache(os.path.join(CACHE_DIR, 'fragmentos-libro')) if use_cache else None
+
+	with make_build_dir('libro', use_cache) as build_dir, make_svg_cache(use_cache) as svg_dir, \
+	     make_renderer(render_workers) as renderer:
+		svg = SvgConverter(svg_dir)
+		emit_book(filenames, build_dir, make_markdown(), svg, make_highlighter(use_cache), fragments,
+		          profiler, renderer, make_asset_store(use_cache))
+
+		if svg.run(profiler):
+			profiler.finish()
+			return False
+
+		if tex_only:
+			export_tex(build_dir, outname)
+			profiler.finish()
+			return True
+
+		ok, log = backend.compile(build_dir, interactive, None, profiler)
+
+		if not ok:
+			print('Error al compilar el libro con LaTeX:', log)
+		else:
+			shutil.copy(os.path.join(build_dir, f'{JOBNAME}.pdf'), outname)
+
+			if split is not None:
+				os.makedirs(split, exist_ok=True)
+				with profiler.stage('división'):
+					ok = split_book(build_dir, filenames, split)
+
+	profiler.finish()
+
+	return ok
+
+
+def makefile_notebooks(path='Makefile') -> list[str]:
+	"""Cuadernos de la variable CUADERNOS del Makefile (en su orden)"""
+
+	with open(path) as mfile:
+		# Une las líneas partidas con barras invertidas
+		text = mfile.read().replace('\\\n', ' ')
+
+	for line in text.splitlines():
+		if (match := re.match(r'CUADERNOS\s*:?=(.*)', line)) is not None:
+			return match.group(1).split()
+
+	return []
+
+
+class ConversionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	"""Servidor de conversiones que reutiliza un formato de LaTeX precompilado"""
+
+	daemon_threads = True
+
+	def __init__(self, path: str, workers=None, backend: LatexBackend | None = None):
+		# Se comparten el parseador de Markdown y el formato con el preámbulo
+		self.backend = backend or BACKENDS[LATEX_CMD]
+		self.md = make_markdown()
+		self.fmt = build_format(self.backend.command) if self.backend.formats else None
+		self.workers = workers
+
+		super().__init__(path, ConversionHandler)
+
+
+class ConversionHandler(socketserver.StreamRequestHandler):
+	"""Atiende una petición de conversión (una línea JSON con los cuadernos)"""
+
+	def handle(self):
+		try:
+			request = json.loads(self.rfile.readline())
+			jobs = [tuple(job) for job in request['trabajos']]
+
+		except (ValueError, KeyError, TypeError) as e:
+			self.reply({'error': f'petición incorrecta: {e}'})
+			return
+
+		use_cache = request.get('cache', False)
+
+		if len(jobs) == 1:
+			(filename, outname), = jobs
+			results = {filename: convert(filename, outname, use_cache=use_cache, md=self.server.md,
+			                             fmt=self.server.fmt, backend=self.server.backend)}
+		else:
+			results = convert_many(jobs, use_cache=use_cache, workers=self.server.workers,
+			                       md=self.server.md, fmt=self.server.fmt, backend=self.server.backend)
+
+		self.reply({'resultados': results})
+
+	def reply(self, response: dict):
+		self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+def serve(path: str, workers=None, backend: LatexBackend | None = None) -> int:
+	"""Atiende peticiones de conversión en un socket Unix hasta que se interrumpe"""
+
+	with contextlib.suppress(FileNotFoundError):
+		os.unlink(path)
+
+	os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+	with ConversionServer(path, workers, backend) as server:
+		if server.fmt is None:
+			print('Aviso: no se usará un formato precompilado')
+
+		print(f'Esperando peticiones en {path}')
+
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			os.unlink(path)
+
+	return 0
+
+
+def remote_convert(path: str, jobs: list[tuple[str, str]], use_cache=False) -> dict[str, bool] | None:
+	"""Envía los cuadernos al servidor de conversiones (None si no hay servidor)"""
+
+	# El servidor puede tener otro directorio actual
+	request = {
+		'trabajos': [(os.path.abspath(filename), os.path.abspath(outname)) for filename, outname in jobs],
+		'cache': use_cache,
+	}
+
+	try:
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+			sock.connect(path)
+			sock.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+
+			with sock.makefile('rb') as response:
+				response = json.loads(response.readline())
+
+	except (OSError, ValueError):
+		return None
+
+	if 'error' in response:
+		print('Error del servidor:', response['error'])
+		return {filename: False for filename, _ in jobs}
+
+	# Traduce las rutas absolutas a las de la petición
+	return {filename: response['resultados'].get(os.path.abspath(filename), False) for filename, _ in jobs}
+
+
+class InotifyWatcher:
+	"""Vigila cambios en archivos de varios directorios con inotify (solo Linux)"""
+
+	IN_CLOSE_WRITE = 0x08
+	IN_MOVED_TO = 0x80
+	EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+	def __init__(self):
+		self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+		self.dirs = {}  # directorio vigilado por cada descriptor
+
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), 'inotify_init1')
+
+	def add(self, directory: str):
+		"""Vigila los archivos de un directorio"""
+
+		wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.IN_CLOSE_WRITE | self.IN_MOVED_TO)
+
+		if wd < 0:
+			raise OSError(ctypes.get_errno(), 'inotify_add_watch', directory)
+
+		self.dirs[wd] = directory
+
+	def read(self, timeout=None) -> set[str]:
+		"""Espera cambios y devuelve las rutas de los archivos modificados"""
+
+		if not select.select([self.fd], [], [], timeout)[0]:
+			return set()
+
+		data, pos, changed = os.read(self.fd, 1 << 16), 0, set()
+
+		while pos < len(data):
+			wd, _, _, length = self.EVENT.unpack_from(data, pos)
+			name = data[pos + self.EVENT.size:pos + self.EVENT.size + length].rstrip(b'\0')
+			changed.add(os.path.join(self.dirs[wd], os.fsdecode(name)))
+			pos += self.EVENT.size + length
+
+		return changed
+
+	def close(self):
+		os.close(self.fd)
+
+
+class PollingWatcher:
+	"""Vigila cambios en archivos de varios directorios consultando sus fechas"""
+
+	INTERVAL = 1.0  # tiempo entre consultas (segundos)
+
+	def __init__(self):
+		self.dirs = {}  # estado de los archivos de cada directorio vigilado
+
+	@staticmethod
+	def scan(directory: str) -> dict:
+		with os.scandir(directory) as entries:
+			return {entry.path: (st.st_mtime_ns, st.st_size) for entry in entries
+			        if entry.is_file() and (st := entry.stat())}
+
+	def add(self, directory: str):
+		"""Vigila los archivos de un directorio"""
+		self.dirs[directory] = self.scan(directory)
+
+	def read(self, timeout=None) -> set[str]:
+		"""Espera cambios y devuelve las rutas de los archivos modificados"""
+
+		start = time.monotonic()
+
+		while True:
+			changed = set()
+
+			for directory, old in self.dirs.items():
+				self.dirs[directory] = new = self.scan(directory)
+				changed.update(path for path, stat in new.items() if old.get(path) != stat)
+
+			if changed:
+				return changed
+
+			if timeout is not None and time.monotonic() - start >= timeout:
+				return set()
+
+			time.sleep(self.INTERVAL if timeout is None else min(self.INTERVAL, timeout))
+
+	def close(self):
+		pass
+
+
+def make_watcher():
+	"""Vigilante de archivos con inotify o, si no está disponible, por consulta"""
+
+	try:
+		return InotifyWatcher()
+	except (OSError, AttributeError, TypeError):
+		return PollingWatcher()
+
+
+def notebook_images(filename: str) -> set[str]:
+	"""Imágenes de las que depende un cuaderno según su última generación en la caché"""
+
+	with make_build_dir(filename, use_cache=True) as build_dir:
+		try:
+			with open(os.path.join(build_dir, DEPENDENCIES)) as dfile:
+				images = json.load(dfile)
+		except (OSError, ValueError):
+			images = ()
+
+	return {os.path.abspath(path) for path in images}
+
+
+def watch(directory: str, dest: str | None, workers=None, backend: LatexBackend | None = None,
+          tex_only=False) -> int:
+	"""Reconvierte los cuadernos de un directorio cuando cambian ellos o sus imágenes"""
+
+	# Los destinos se calculan antes de cambiar de directorio, ya que
+	# el resto del programa supone que los cuadernos están en el actual
+	dest = os.path.abspath(dest) if dest else os.getcwd()
+	os.chdir(directory)
+
+	def is_notebook(path):
+		name = os.path.basename(path)
+		return name.endswith('.ipynb') and not name.startswith('.') and os.path.dirname(path) == os.getcwd()
+
+	def outname(filename):
+		return output_name(filename, dest, batch=True)
+
+	def rebuild(notebooks):
+		# Un cuaderno a medio guardar o con errores no detiene la vigilancia
+		try:
+			if len(notebooks) == 1:
+				filename, = notebooks
+				convert(filename, outname(filename), use_cache=True, backend=backend, tex_only=tex_only)
+			else:
+				convert_many([(filename, outname(filename)) for filename in notebooks],
+				             use_cache=True, workers=workers, backend=backend, tex_only=tex_only)
+
+		except Exception as e:
+			print(f'Error al convertir {", ".join(notebooks)}: {type(e).__name__} {e}')
+
+		# Actualiza las dependencias de los cuadernos convertidos
+		for filename in notebooks:
+			for deps in dependents.values():
+				deps.discard(filename)
+			for image in notebook_images(filename):
+				dependents.setdefault(image, set()).add(filename)
+				if (image_dir := os.path.dirname(image)) not in watched:
+					watcher.add(image_dir)
+					watched.add(image_dir)
+
+	watcher = make_watcher()
+	watched = {os.getcwd()}
+	watcher.add(os.getcwd())
+
+	# Cuadernos que dependen de cada imagen (por ruta absoluta)
+	dependents = {}
+
+	# Se parte de una conversión de todos los cuadernos (con la caché es
+	# inmediata para los que no han cambiado)
+	rebuild(sorted(name for name in os.listdir() if is_notebook(os.path.abspath(name))))
+	print(f'Vigilando {directory} ({type(watcher).__name__})')
+
+	try:
+		while True:
+			changed = watcher.read()
+
+			# Jupyter guarda varias veces seguidas, así que se espera a que
+			# pase un tiempo sin cambios antes de convertir
+			while more := watcher.read(DEBOUNCE):
+				changed |= more
+
+			affected = {os.path.basename(path) for path in changed if is_notebook(path)}
+			affected.update(filename for path in changed for filename in dependents.get(path, ()))
+
+			if affected:
+				rebuild(sorted(affected))
+
+	except KeyboardInterrupt:
+		pass
+	finally:
+		watcher.close()
+
+	return 0
+
+
+def output_name(cuaderno: str, dest: str | None, batch=False) -> str:
+	"""Determina el nombre del archivo de salida"""
+
+	outname = os.path.splitext(os.path.basename(cuaderno))[0] + '.pdf'
+
+	if dest:
+		# Si es un directorio, guarda el archivo en él
+		if os.path.isdir(dest):
+			outname = os.path.join(dest, outname)
+		# Si la ruta no existe y no acaba en .pdf, asume que es un directorio y lo crea
+		# (con varios cuadernos el destino siempre es un directorio)
+		elif not os.path.exists(dest) and (batch or not dest.endswith('.pdf')):
+			os.makedirs(dest)
+			outname = os.path.join(dest, outname)
+		# En otro caso, guarda el archivo en la ruta indicada
+		else:
+			outname = dest
+
+	return outname
+
+
+def book_main(args, parser, backend: LatexBackend) -> int:
+	"""Construcción del libro con todos los cuadernos"""
+
+	if args.remote:
+		parser.error('el servidor de conversiones no construye libros')
+
+	cuadernos = args.cuaderno or makefile_notebooks()
+
+	if not cuadernos:
+		parser.error('no hay cuadernos en el Makefile')
+
+	# El destino puede ser el nombre del PDF o un directorio
+	outname = args.o or 'libro.pdf'
+
+	if not outname.endswith('.pdf') or os.path.isdir(outname):
+		os.makedirs(outname, exist_ok=True)
+		outname = os.path.join(outname, 'libro.pdf')
+
+	# Se crea el directorio del PDF antes de compilar (make libro usa pdf/libro.pdf)
+	elif os.path.dirname(outname):
+		os.makedirs(os.path.dirname(outname), exist_ok=True)
+
+	profiler = Profiler('libro')
+	ok = convert_book(cuadernos, outname, interactive=args.interactive, use_cache=args.cache, profiler=profiler,
+	                  backend=backend, tex_only=args.tex_only, render_workers=args.render_workers,
+	                  split=args.split)
+
+	if args.profile:
+		profiler.save(args.profile)
+
+	if args.profile_summary:
+		print_profile_summary([profiler], args.profile)
+
+	return 0 if ok else 1
+
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Convierte cuadernos de Jupyter a PDF')
+	parser.add_argument('cuaderno', help='Cuaderno', nargs='*')
+	parser.add_argument('--interactive', '-i', help='Modo interactivo de LaTeX', action='store_true')
+	parser.add_argument('--cache', help='Usa una caché para ahorrar tiempo de compilación', action='store_true')
+	parser.add_argument('-o', help='Destino del archivo generado (si es carpeta existente, genera un archivo en ella)')
+	parser.add_argument('-j', help='Número de compilaciones LaTeX simultáneas (por defecto, tantas como núcleos)',
+	                    type=int, metavar='N')
+	parser.add_argument('--serve', help='Atiende peticiones de conversión con el preámbulo precompilado',
+	                    action='store_true')
+	parser.add_argument('--remote', help='Envía los cuadernos al servidor de conversiones', action='store_true')
+	parser.add_argument('--socket', help=f'Socket del servidor de conversiones (por defecto, {SOCKET})',
+	                    default=SOCKET)
+	parser.add_argument('--watch', help='Reconvierte los cuadernos del directorio cuando cambian',
+	                    metavar='DIR')
+	parser.add_argument('--profile', help='Guarda en el directorio un informe de tiempos de cada cuaderno',
+	                    metavar='DIR')
+	parser.add_argument('--profile-summary', help='Muestra un resumen de los tiempos de todos los cuadernos',
+	                    action='store_true')
+	parser.add_argument('--tex-only', help='Genera el documento LaTeX y sus imágenes sin compilarlo',
+	                    action='store_true')
+	parser.add_argument('--backend', help=f'Compilador de LaTeX (por defecto, {LATEX_CMD})',
+	                    choices=BACKENDS.keys(), default=LATEX_CMD)
+	parser.add_argument('--render-workers', help='Convierte las celdas Markdown en paralelo con N procesos',
+	                    type=int, metavar='N')
+	parser.add_argument('--book', help='Une los cuadernos (por defecto, los del Makefile) en un libro',
+	                    action='store_true')
+	parser.add_argument('--split', help='Divide después el libro en un PDF por cuaderno en el directorio',
+	                    metavar='DIR')
+	parser.add_argument('--gc', help='Borra de la caché las imágenes que ya no se usan', action='store_true')
+
+	args = parser.parse_args()
+	backend = BACKENDS[args.backend]
+
+	if args.gc:
+		return collect_garbage()
+
+	if args.serve:
+		return serve(args.socket, workers=args.j, backend=backend)
+
+	if args.watch:
+		return watch(args.watch, args.o, workers=args.j, backend=backend, tex_only=args.tex_only)
+
+	if args.book:
+		return book_main(args, parser, backend)
+
+	if not args.cuaderno:
+		parser.error('se necesita al menos un cuaderno')
+
+	batch = len(args.cuaderno) > 1
+
+	if batch and args.o and args.o.endswith('.pdf') and not os.path.isdir(args.o):
+		parser.error('con varios cuadernos el destino -o debe ser un directorio')
+
+	jobs = [(cuaderno, output_name(cuaderno, args.o, batch=batch)) for cuaderno in args.cuaderno]
+
+	if args.remote and args.tex_only:
+		parser.error('el servidor de conversiones siempre compila los documentos')
+
+	# Si hay un servidor de conversiones, le encarga el trabajo
+	if args.remote:
+		if (results := remote_convert(args.socket, jobs, use_cache=args.cache)) is not None:
+			for cuaderno, _ in jobs:
+				print(f'{"✓" if results[cuaderno] else "✗"} {cuaderno}')
+
+			return 0 if all(results.values()) else 1
+
+		print(f'No hay servidor de conversiones en {args.socket}, se convierte localmente')
+
+	profilers = {}
+
+	# Un único cuaderno se convierte directamente y el modo interactivo
+	# de LaTeX no admite compilaciones simultáneas
+	if not batch or args.interactive:
+		results = {}
+		for cuaderno, outname in jobs:
+			profilers[cuaderno] = profiler = Profiler(cuaderno)
+			results[cuaderno] = convert(cuaderno, outname, interactive=args.interactive, use_cache=args.cache,
+			                            profiler=profiler, backend=backend, tex_only=args.tex_only,
+			                            render_workers=args.render_workers)
+	else:
+		results = convert_many(jobs, use_cache=args.cache, workers=args.j, profilers=profilers,
+		                       backend=backend, tex_only=args.tex_only, render_workers=args.render_workers)
+
+	# Informes de tiempos
+	if args.profile:
+		for profiler in profilers.values():
+			profiler.save(args.profile)
+
+	if args.profile_summary:
+		print_profile_summary(profilers.values(), args.profile)
 
-	return 0 if convert(args.cuaderno, outname, interactive=args.interactive, use_cache=args.cache) else 1
+	return 0 if all(results.values()) else 1
 
 
 if __name__ == '__main__':
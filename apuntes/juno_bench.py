@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+#
+# Pruebas de rendimiento de juno.py con cuadernos sintéticos
+#
+
+import base64
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+import juno
+
+# Línea base con la que se comparan los resultados
+BASELINE = os.path.join(juno.CACHE_DIR, 'bench.json')
+
+# Palabras para generar texto de relleno
+WORDS = ('lista', 'función', 'variable', 'bucle', 'diccionario', 'matriz', 'archivo',
+         'recursión', 'índice', 'valor', 'tipo', 'cadena', 'entero', 'elemento', 'clave')
+
+# Fórmulas para el texto matemático
+FORMULAS = (r'\sum_{i=1}^n i^2', r'x_{k+1} = x_k - \frac{f(x_k)}{f\'(x_k)}', r'\binom{n}{k}',
+            r'\int_0^1 e^{-x^2}\,dx', r'A \cdot B = \sum_k a_{ik} b_{kj}', r'O(n \log n)')
+
+# Traza de error con las secuencias de escape que produce IPython
+TRACEBACK = [
+	'\x1b[0;31m---------------------------------------------------------------------------\x1b[0m',
+	'\x1b[0;31m{error}\x1b[0m                         Traceback (most recent call last)',
+	'Cell \x1b[0;32mIn[{k}], line 3\x1b[0m\n\x1b[1;32m      1\x1b[0m \x1b[38;5;28;01mdef\x1b[39;00m '
+	'\x1b[38;5;21mf\x1b[39m(x):\n\x1b[1;32m----> 3\x1b[0m     \x1b[38;5;28;01mreturn\x1b[39;00m x[{k}]',
+	'\x1b[0;31m{error}\x1b[0m: \x1b[1;4m{message}\x1b[0m',
+]
+
+
+class NotebookGenerator:
+	"""Generador de cuadernos sintéticos con la composición indicada"""
+
+	def __init__(self, markdown=40, tables=5, math=10, code=40, tracebacks=5, images=3, seed=0):
+		self.counts = {
+			'markdown': markdown,  # celdas de texto
+			'tables': tables,  # celdas con tablas
+			'math': math,  # celdas con fórmulas
+			'code': code,  # celdas de código con su resultado
+			'tracebacks': tracebacks,  # celdas con errores (secuencias ANSI)
+			'images': images,  # celdas con imágenes PNG como resultado
+		}
+		self.random = random.Random(seed)
+		self.png = None  # imagen PNG en base64 (se genera una vez)
+
+	def scaled(self, factor: int):
+		"""Generador con todas las cantidades multiplicadas por un factor"""
+		return NotebookGenerator(**{kind: n * factor for kind, n in self.counts.items()})
+
+	def sentence(self, n=12):
+		words = self.random.choices(WORDS, k=n)
+		return ' '.join(words).capitalize() + '.'
+
+	def paragraph(self):
+		# Texto con algo de formato y código en línea
+		parts = [self.sentence() for _ in range(4)]
+		parts.insert(1, f'Se usa `{self.random.choice(WORDS)}[0]` y **{self.random.choice(WORDS)}**.')
+		parts.insert(3, f'Véase *{self.random.choice(WORDS)}* en [la documentación](https://docs.python.org).')
+		return ' '.join(parts)
+
+	def markdown_cell(self, k):
+		lines = [f'## Apartado {k}\n', '\n', self.paragraph() + '\n', '\n',
+		         *(f'* {self.sentence(6)}\n' for _ in range(3))]
+		return {'cell_type': 'markdown', 'metadata': {}, 'source': lines}
+
+	def table_cell(self, k):
+		columns = self.random.randint(2, 5)
+		rows = [' | '.join(self.random.choices(WORDS, k=columns)) for _ in range(self.random.randint(3, 10))]
+		lines = ['| ' + ' | '.join(f'Columna {c}' for c in range(columns)) + ' |\n',
+		         '|' + ':--|' * columns + '\n',
+		         *(f'| {row} |\n' for row in rows)]
+		return {'cell_type': 'markdown', 'metadata': {}, 'source': lines}
+
+	def math_cell(self, k):
+		formula = self.random.choice(FORMULAS)
+		lines = [f'{self.sentence()} Sea ${formula}$ la expresión.\n', '\n', f'$${formula}$$\n']
+		return {'cell_type': 'markdown', 'metadata': {}, 'source': lines}
+
+	def code_cell(self, k, outputs=None):
+		name = self.random.choice(WORDS)
+		source = [f'def {name}_{k}(x):\n', '\t"""Función de ejemplo"""\n',
+		          f'\treturn [x * i for i in range({k})]\n', '\n', f'{name}_{k}(2)']
+		if outputs is None:
+			outputs = [{'output_type': 'execute_result', 'data': {'text/plain': [repr(list(range(0, 2 * k, 2)))]},
+			            'metadata': {}, 'execution_count': k}]
+		return {'cell_type': 'code', 'metadata': {}, 'source': source, 'outputs': outputs,
+		        'execution_count': k}
+
+	def traceback_cell(self, k):
+		error = self.random.choice(('IndexError', 'KeyError', 'TypeError'))
+		traceback = [line.format(k=k, error=error, message=self.sentence(5)) for line in TRACEBACK]
+		return self.code_cell(k, [{'output_type': 'error', 'ename': error, 'evalue': '',
+		                           'traceback': traceback}])
+
+	def image_cell(self, k):
+		if self.png is None:
+			img = Image.effect_mandelbrot((320, 240), (-2, -1.2, 1, 1.2), 64).convert('RGB')
+			buffer = io.BytesIO()
+			img.save(buffer, format='PNG')
+			self.png = base64.b64encode(buffer.getvalue()).decode('ascii')
+
+		# Se varía un byte del final (en base64) para que cada imagen sea distinta
+		png = self.png[:-8] + base64.b64encode(k.to_bytes(6, 'big')).decode('ascii')
+		return self.code_cell(k, [{'output_type': 'display_data', 'metadata': {},
+		                           'data': {'image/png': png, 'text/plain': ['<Figure>']}}])
+
+	def cells(self):
+		"""Celdas del cuaderno mezcladas de forma reproducible"""
+
+		makers = {
+			'markdown': self.markdown_cell,
+			'tables': self.table_cell,
+			'math': self.math_cell,
+			'code': self.code_cell,
+			'tracebacks': self.traceback_cell,
+			'images': self.image_cell,
+		}
+
+		kinds = [kind for kind, n in self.counts.items() for _ in range(n)]
+		self.random.shuffle(kinds)
+
+		yield {'cell_type': 'markdown', 'metadata': {}, 'source': ['# Cuaderno sintético']}
+
+		for k, kind in enumerate(kinds, start=1):
+			yield makers[kind](k)
+
+	def notebook(self) -> dict:
+		return {
+			'cells': list(self.cells()),
+			'metadata': {'authors': [{'name': 'Juno'}]},
+			'nbformat': 4,
+			'nbformat_minor': 5,
+		}
+
+	def write(self, filename: str):
+		with open(filename, 'w') as nbfile:
+			json.dump(self.notebook(), nbfile, indent=1, ensure_ascii=False)
+
+
+def best_time(function, repeat: int) -> float:
+	"""Mejor tiempo de varias ejecuciones de una función"""
+
+	times = []
+
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function()
+		times.append(time.perf_counter() - start)
+
+	return min(times)
+
+
+def bench_writer(notebook: dict, repeat: int) -> dict:
+	"""Velocidad de LaTeXWriter sobre las celdas Markdown"""
+
+	sources = [''.join(celda['source']) for celda in notebook['cells'] if celda['cell_type'] == 'markdown']
+
+	with tempfile.TemporaryDirectory() as build_dir:
+		svg = juno.SvgConverter(build_dir)
+		lt = juno.LaTeXWriter(io.StringIO(), juno.make_markdown(), '.', build_dir,
+		                      juno.AssetTracker(svg), juno.Highlighter())
+
+		def run():
+			for source in sources:
+				lt.render(source, {})
+
+		seconds = best_time(run, repeat)
+
+	size = sum(len(source) for source in sources)
+	return {'segundos': seconds, 'celdas/s': len(sources) / seconds, 'MB/s': size / seconds / 1e6}
+
+
+def bench_ansi(notebook: dict, repeat: int) -> dict:
+	"""Velocidad de convert_ansi sobre las trazas de error"""
+
+	tracebacks = [output['traceback'] for celda in notebook['cells'] if celda['cell_type'] == 'code'
+	              for output in celda['outputs'] if output['output_type'] == 'error']
+
+	if not tracebacks:
+		return {}
+
+	seconds = best_time(lambda: [juno.convert_ansi(traceback) for traceback in tracebacks], repeat)
+
+	size = sum(len(line) for traceback in tracebacks for line in traceback)
+	return {'segundos': seconds, 'trazas/s': len(tracebacks) / seconds, 'MB/s': size / seconds / 1e6}
+
+
+def bench_emit(filename: str, repeat: int) -> dict:
+	"""Generación completa del .tex de un cuaderno (sin ejecutar LaTeX)"""
+
+	md = juno.make_markdown()
+
+	def run():
+		# Sin cachés, para medir el trabajo completo en cada repetición
+		with tempfile.TemporaryDirectory() as build_dir, tempfile.TemporaryDirectory() as svg_dir:
+			juno.emit_tex(filename, build_dir, md, juno.SvgConverter(svg_dir), juno.Highlighter())
+
+	seconds = best_time(run, repeat)
+
+	ncells = sum(1 for _ in juno.NotebookReader(filename))
+	return {'segundos': seconds, 'celdas/s': ncells / seconds,
+	        'MB/s': os.path.getsize(filename) / seconds / 1e6}
+
+
+def run_benchmarks(generator: NotebookGenerator, scales: list[int], repeat: int) -> dict:
+	"""Ejecuta las pruebas para cada factor de escala"""
+
+	results = {}
+
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		for scale in scales:
+			scaled = generator.scaled(scale)
+			notebook = scaled.notebook()
+
+			filename = os.path.join(tmp_dir, f'sintético-{scale}.ipynb')
+			with open(filename, 'w') as nbfile:
+				json.dump(notebook, nbfile, indent=1, ensure_ascii=False)
+
+			for name, result in (('escritor', bench_writer(notebook, repeat)),
+			                     ('ansi', bench_ansi(notebook, repeat)),
+			                     ('tex', bench_emit(filename, repeat))):
+				if result:
+					results[f'{name}@{scale}'] = result
+
+	return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+	"""Muestra los resultados frente a la línea base y dice si hay regresiones"""
+
+	ok = True
+
+	print(f'{"prueba":14} {"segundos":>10} {"base":>10} {"relación":>9}  rendimiento')
+
+	for name, result in results.items():
+		rates = '  '.join(f'{value:.1f} {unit}' for unit, value in result.items() if unit != 'segundos')
+
+		if (base := baseline.get(name)) is None:
+			print(f'{name:14} {result["segundos"]:10.4f} {"-":>10} {"-":>9}  {rates}')
+			continue
+
+		ratio = result['segundos'] / base['segundos']
+		mark = ''
+
+		if ratio > 1 + tolerance:
+			mark, ok = ' ✗', False
+
+		print(f'{name:14} {result["segundos"]:10.4f} {base["segundos"]:10.4f} {ratio:9.2f}  {rates}{mark}')
+
+	return ok
+
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Pruebas de rendimiento de juno.py')
+	parser.add_argument('--scale', help='Factores de escala de los cuadernos', type=int, nargs='+',
+	                    default=[1, 2, 4, 8])
+	parser.add_argument('--repeat', help='Repeticiones de cada prueba (se toma la mejor)', type=int, default=3)
+	parser.add_argument('--markdown', help='Celdas de texto', type=int, default=40)
+	parser.add_argument('--tables', help='Celdas con tablas', type=int, default=5)
+	parser.add_argument('--math', help='Celdas con fórmulas', type=int, default=10)
+	parser.add_argument('--code', help='Celdas de código', type=int, default=40)
+	parser.add_argument('--tracebacks', help='Celdas con trazas de error', type=int, default=5)
+	parser.add_argument('--images', help='Celdas con imágenes PNG', type=int, default=3)
+	parser.add_argument('--baseline', help='Archivo con la línea base', default=BASELINE)
+	parser.add_argument('--save', help='Guarda los resultados como nueva línea base', action='store_true')
+	parser.add_argument('--tolerance', help='Empeoramiento admitido respecto a la línea base',
+	                    type=float, default=0.1)
+	parser.add_argument('--generate', help='Solo escribe el cuaderno sintético (escala 1) en el archivo',
+	                    metavar='FILE')
+
+	args = parser.parse_args()
+
+	generator = NotebookGenerator(args.markdown, args.tables, args.math, args.code, args.tracebacks, args.images)
+
+	if args.generate:
+		generator.write(args.generate)
+		return 0
+
+	# Las rutas de juno.py son relativas al directorio de los apuntes
+	os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+	results = run_benchmarks(generator, args.scale, args.repeat)
+
+	try:
+		with open(args.baseline) as bfile:
+			baseline = json.load(bfile)
+	except (OSError, ValueError):
+		baseline = {}
+
+	ok = compare(results, baseline, args.tolerance)
+
+	if args.save:
+		os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+		with open(args.baseline, 'w') as bfile:
+			json.dump(results, bfile, indent=1, ensure_ascii=False)
+
+	return 0 if ok else 1
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -4,38 +4,172 @@
 # Rubén Rubio (Universidad Complutense de Madrid) 2023
 #
 
+import ast
+import concurrent.futures
+import csv
+import functools
+import hashlib
+import json
+import os
+import queue
+import re
 import subprocess
+import sys
 import tempfile
+import threading
+import time
 
-import nbconvert
-import nbformat
-from nbconvert.preprocessors import ExecutePreprocessor
+# Directorio de la caché de ejecución (relativo al directorio actual)
+CACHE_DIR = os.path.join('.cache', 'nbcheck')
 
+# Directorio con el código extraído de los cuadernos para mypy y su caché
+MYPY_DIR = os.path.join('.cache', 'mypy')
 
-def mypy(nb, args):
-	""""Comprobación de tipos con mypy"""
+# Expresión evaluada en el núcleo para medir su consumo de recursos
+# (tiempo de CPU en segundos y máximo de memoria residente en KiB en Linux)
+USAGE_EXPR = '(lambda r: (r.ru_utime + r.ru_stime, r.ru_maxrss))(__import__("resource").getrusage(0))'
 
-	# Extrae el código Python del cuaderno
-	converter = nbconvert.PythonExporter(exclude_markdown=True, exclude_output=True, exclude_raw=True)
-	code, _ = converter.from_notebook_node(nb)
 
-	# Borra líneas que empiezan por get_ipython (comandos mágicos en el cuaderno)
-	code = '\n'.join(line for line in code.splitlines() if not line.startswith('get_ipython'))
+def text(value):
+	"""Texto de un campo multilínea del cuaderno (una cadena o una lista de líneas)"""
 
-	# Ejecuta mypy y muestra los errores por pantalla
-	with tempfile.NamedTemporaryFile(mode='w', suffix='.py') as outfile:
-		outfile.write(code)
-		outfile.flush()
+	return value if isinstance(value, str) else ''.join(value)
+
+
+class Notebook:
+	"""Cuaderno de Jupyter leído directamente de su JSON
+
+	Basta para las acciones que solo consultan el código, el texto o las
+	salidas del cuaderno, que así no tienen que cargar nbformat ni nbconvert.
+	"""
+
+	def __init__(self, filename):
+		with open(filename) as ipynb:
+			self.data = json.load(ipynb)
+
+	def __getitem__(self, key):
+		return self.data[key]
+
+	def sources(self, cell_type: str):
+		"""Código de las celdas del tipo dado junto con su índice"""
+
+		return ((k, text(celda['source'])) for k, celda in enumerate(self.data['cells'])
+		        if celda['cell_type'] == cell_type)
+
+	def outputs(self):
+		"""Salidas de todas las celdas"""
+
+		return (out for celda in self.data['cells'] for out in celda.get('outputs', ()))
+
+	def save(self, filename):
+		"""Guarda el cuaderno con el mismo formato que nbformat"""
+
+		with open(filename, 'w') as ipynb:
+			json.dump(self.data, ipynb, sort_keys=True, indent=1, ensure_ascii=False)
+			ipynb.write('\n')
+
+
+def python_code(nb):
+	"""Código Python del cuaderno y la celda y línea de origen de cada línea"""
+
+	lines, origin = [], []
+
+	for k, source in nb.sources('code'):
+		source = source.splitlines()
+
+		# Las celdas con órdenes mágicas de celda no contienen Python
+		if source and source[0].startswith('%%'):
+			continue
+
+		for n, line in enumerate(source, start=1):
+			# Las órdenes mágicas y del sistema se sustituyen por pass
+			if (magic := re.match(r'(\s*)[%!]', line)):
+				line = magic.group(1) + 'pass'
+
+			lines.append(line)
+			origin.append((k, n))
+
+	return '\n'.join(lines) + '\n', origin
+
+
+def module_path(filename, taken: set):
+	"""Ruta estable del módulo con el código del cuaderno para mypy"""
+
+	name = re.sub(r'\W', '_', os.path.splitext(os.path.basename(filename))[0])
+
+	if not name.isidentifier():
+		name = f'_{name}'
 
-		subprocess.run(['mypy', '--pretty', outfile.name])
+	# Cuadernos con el mismo nombre en distintos directorios
+	candidate, k = name, 1
 
+	while candidate in taken:
+		k += 1
+		candidate = f'{name}_{k}'
 
-def lang(nb, args):
+	taken.add(candidate)
+
+	return os.path.join(MYPY_DIR, f'{candidate}.py')
+
+
+def mypy(filenames, args):
+	""""Comprobación de tipos con mypy
+
+	El código de cada cuaderno se guarda siempre en el mismo módulo para
+	que mypy (o su demonio con --daemon) aproveche su caché incremental
+	y se comprueban todos los cuadernos a la vez.
+	"""
+
+	os.makedirs(MYPY_DIR, exist_ok=True)
+
+	modules, taken = {}, set()  # módulo -> (cuaderno, origen de cada línea)
+
+	for filename in filenames:
+		code, origin = python_code(Notebook(filename))
+		path = module_path(filename, taken)
+		modules[path] = (filename, origin)
+
+		# Solo se reescribe el módulo si ha cambiado
+		try:
+			with open(path) as pyfile:
+				if pyfile.read() == code:
+					continue
+		except OSError:
+			pass
+
+		with open(path, 'w') as pyfile:
+			pyfile.write(code)
+
+	options = ['--cache-dir', os.path.join(MYPY_DIR, 'cache'), '--no-pretty', '--no-error-summary',
+	           '--show-error-codes', *modules]
+
+	if args.daemon:
+		command = ['dmypy', '--status-file', os.path.join(MYPY_DIR, 'dmypy.json'), 'run', '--', *options]
+	else:
+		command = ['mypy', *options]
+
+	result = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+
+	# Traduce las posiciones de los errores a celdas del cuaderno
+	for line in result.stdout.splitlines():
+		if (match := re.match(r'(.+?):(\d+): (\w+): (.*)', line)) and match.group(1) in modules:
+			filename, origin = modules[match.group(1)]
+			number = int(match.group(2))
+
+			if 0 < number <= len(origin):
+				k, n = origin[number - 1]
+				line = f'{filename} [celda {k}, línea {n}]: {match.group(3)}: {match.group(4)}'
+
+		print(line)
+
+	return result.returncode
+
+
+def lang(filename, nb, args):
 	"""Comprobación ortográfica del texto"""
 
 	# Extrae el código Markdown del cuaderno
-	converter = nbconvert.MarkdownExporter(exclude_code_cell=True)
-	code, _ = converter.from_notebook_node(nb)
+	code = '\n\n'.join(source for _, source in nb.sources('markdown'))
 
 	# Usa textidote para comprobar la ortografía y gramática
 	with tempfile.NamedTemporaryFile(mode='w', suffix='.md') as outfile:
@@ -51,7 +185,7 @@ def lang(nb, args):
 				subprocess.run([*comando, '-output', 'html', outfile.name], stdout=html)
 
 
-def reduce(nb, args):
+def reduce(filename, nb, args):
 	"""Reduce el tamaño del archivo convirtiendo las imágenes"""
 
 	import base64
@@ -59,55 +193,507 @@ def reduce(nb, args):
 	from PIL import Image
 
 	# Considera las salidas de tipo display de cada celda
-	for celda in nb['cells']:
-		for out in celda.get('outputs', ()):
-			if out['output_type'] == 'display_data':
-				if 'image/png' in out['data']:
-					png_base64 = out['data']['image/png']
-					# Convierte la imagen PNG en JPG
-					img = Image.open(io.BytesIO(base64.b64decode(png_base64)))
-					stream = io.BytesIO()
-					img.convert('RGB').save(stream, format='jpeg')
-					jpg_base64 = base64.b64encode(stream.getvalue()).decode('ascii')
-					# Si hay mejora de tamaño la reemplaza
-					if png_base64 > jpg_base64:
-						out['data'].pop('image/png')
-						out['data']['image/jpeg'] = jpg_base64
+	for out in nb.outputs():
+		if out['output_type'] == 'display_data':
+			if 'image/png' in out['data']:
+				png_base64 = text(out['data']['image/png'])
+				# Convierte la imagen PNG en JPG
+				img = Image.open(io.BytesIO(base64.b64decode(png_base64)))
+				stream = io.BytesIO()
+				img.convert('RGB').save(stream, format='jpeg')
+				jpg_base64 = base64.b64encode(stream.getvalue()).decode('ascii')
+				# Si hay mejora de tamaño la reemplaza
+				if png_base64 > jpg_base64:
+					out['data'].pop('image/png')
+					out['data']['image/jpeg'] = jpg_base64
 
 	# Guarda el cuaderno reducido
-	with open(args.cuaderno + '_reduced', 'w') as f:
-		nbformat.write(nb, f)
+	nb.save(filename + '_reduced')
+
+
+class KernelPool:
+	"""Núcleos de Jupyter arrancados de antemano para ejecutar varios cuadernos
+
+	Cada cuaderno se ejecuta en un núcleo limpio, así que al terminar se
+	apaga el que ha usado y se arranca otro en segundo plano si aún quedan
+	cuadernos por ejecutar.
+	"""
+
+	def __init__(self, size: int, total: int, kernel_name='python3'):
+		self.kernel_name = kernel_name
+		self.remaining = total  # núcleos que aún hay que arrancar
+		self.ready = queue.Queue()  # núcleos arrancados (o errores al arrancarlos)
+		self.lock = threading.Lock()
+		self.starter = concurrent.futures.ThreadPoolExecutor(size)
+
+		for _ in range(min(size, total)):
+			self.replenish()
+
+	def replenish(self):
+		"""Arranca otro núcleo en segundo plano si todavía hace falta"""
+
+		with self.lock:
+			if self.remaining <= 0:
+				return
+			self.remaining -= 1
+
+		self.starter.submit(self.start)
+
+	def start(self):
+		from jupyter_client import KernelManager
+
+		km = KernelManager(kernel_name=self.kernel_name)
+
+		try:
+			km.start_kernel()
+			self.ready.put(km)
+		except Exception as e:
+			self.ready.put(e)
+
+	def acquire(self, path: str):
+		"""Obtiene un núcleo arrancado que trabaja en el directorio dado"""
+
+		km = self.ready.get()
+
+		# Se arranca otro núcleo para el siguiente cuaderno aunque este no haya arrancado
+		if isinstance(km, Exception):
+			self.replenish()
+			raise km
+
+		# Los núcleos se arrancan sin saber qué cuaderno ejecutarán,
+		# así que se cambia su directorio al del cuaderno
+		kc = km.client()
+		kc.start_channels()
+		try:
+			kc.wait_for_ready(timeout=60)
+			kc.execute_interactive(f'__import__("os").chdir({path!r})', silent=True, store_history=False)
+
+		# Si el núcleo no responde se apaga para no dejar el proceso huérfano
+		except Exception:
+			self.release(km)
+			raise
+
+		finally:
+			kc.stop_channels()
+
+		return km
+
+	def release(self, km):
+		"""Apaga el núcleo usado y prepara otro para el siguiente cuaderno"""
+
+		# Puede que ya se haya apagado al agotarse el tiempo del cuaderno
+		if km.has_kernel:
+			self.starter.submit(km.shutdown_kernel, now=True)
+
+		self.replenish()
+
+	def close(self):
+		self.starter.shutdown(wait=True)
+
+		while not self.ready.empty():
+			if not isinstance(km := self.ready.get(), Exception):
+				km.shutdown_kernel(now=True)
+
+
+def error_cells(nb):
+	"""Celdas cuya ejecución ha producido un error (índice, tipo y mensaje)"""
+
+	return [(k, out.get('ename', ''), out.get('evalue', ''))
+	        for k, celda in enumerate(nb['cells'])
+	        for out in celda.get('outputs', ()) if out['output_type'] == 'error']
+
+
+def code_chain(nb):
+	"""Resumen encadenado de cada celda de código y de todas las anteriores
+
+	Si el resumen de una celda coincide con el de la ejecución anterior,
+	ni ella ni las anteriores han cambiado desde entonces.
+	"""
+
+	chain, digest = [], hashlib.sha1()
+
+	for celda in nb['cells']:
+		if celda['cell_type'] == 'code':
+			digest.update(text(celda['source']).encode('utf-8'))
+			digest.update(b'\0')
+			chain.append(digest.hexdigest())
+		else:
+			chain.append(None)
+
+	return chain
+
+
+def state_file(filename):
+	return os.path.join(CACHE_DIR, os.path.relpath(filename).replace(os.sep, '_') + '.json')
+
+
+def first_changed(filename, nb):
+	"""Índice de la primera celda de código que hay que ejecutar (None si ninguna)"""
+
+	try:
+		with open(state_file(filename)) as sfile:
+			previous = json.load(sfile)
+	except (OSError, ValueError):
+		previous = []
+
+	previous = [digest for digest in previous if digest is not None]
+	known = 0  # celdas de código que coinciden con la ejecución anterior
+
+	for k, digest in enumerate(code_chain(nb)):
+		if digest is None:
+			continue
+
+		if known >= len(previous) or previous[known] != digest:
+			return k
+
+		# Las celdas que no se han ejecutado (o cuyas salidas se han borrado)
+		# también se tienen que ejecutar aunque su código sea el mismo, salvo
+		# las vacías, que nunca se ejecutan
+		celda = nb['cells'][k]
+
+		if celda.get('execution_count') is None and text(celda['source']).strip():
+			return k
+
+		known += 1
+
+	return None
+
+
+@functools.cache
+def executor_class(mixin):
+	"""Clase de ejecución de cuadernos de nbconvert con el comportamiento dado
+
+	Las ejecuciones particulares se definen como mezclas para que
+	nbconvert solo se cargue cuando realmente se ejecuta un cuaderno.
+	"""
+
+	from nbconvert.preprocessors import ExecutePreprocessor
+
+	return type(mixin.__name__, (mixin, ExecutePreprocessor), {})
+
 
+class IncrementalExecutor:
+	"""Ejecución de un cuaderno a partir de una celda
 
-def run(nb, args):
-	"""Ejecuta el cuaderno y actualiza sus celdas"""
+	Las salidas de las celdas anteriores se conservan y el estado del núcleo
+	se reconstruye cargando un punto de control guardado con dill (si está
+	disponible en el núcleo) o ejecutando de nuevo las celdas sin recoger
+	sus salidas.
+	"""
 
-	ep = ExecutePreprocessor(timeout=600, kernel_name='python3', allow_errors=True, record_timing=False)
-	ep.preprocess(nb)
-	with open(args.cuaderno, 'w') as f:
+	def __init__(self, start: int, checkpoint: str | None = None, **kwargs):
+		super().__init__(**kwargs)
+		self.start = start  # primera celda que se ejecuta de verdad
+		self.checkpoint = checkpoint  # estado del núcleo antes de esa celda
+
+	def preprocess_cell(self, cell, resources, index):
+		if index < self.start:
+			return cell, resources
+
+		if index == self.start:
+			self.restore_state()
+
+		return super().preprocess_cell(cell, resources, index)
+
+	def execute_quietly(self, code: str) -> bool:
+		"""Ejecuta código en el núcleo sin guardar sus salidas en el cuaderno"""
+
+		msg_id = self.kc.execute(code, store_history=True, allow_stdin=False)
+		reply = self.wait_for_reply(msg_id)
+
+		return reply is not None and reply['content']['status'] == 'ok'
+
+	def restore_state(self):
+		"""Reconstruye el estado del núcleo tras las celdas que no se ejecutan"""
+
+		if self.checkpoint is None:
+			return
+
+		if os.path.exists(self.checkpoint):
+			if self.execute_quietly(f'__import__("dill").load_session({self.checkpoint!r})'):
+				return
+
+		for celda in self.nb.cells[:self.start]:
+			if celda.cell_type == 'code':
+				self.execute_quietly(celda.source)
+
+		# Se guarda el estado para la próxima vez (si dill está instalado)
+		self.execute_quietly(f'__import__("dill").dump_session({self.checkpoint!r})')
+
+
+class ProfilingExecutor:
+	"""Ejecución de un cuaderno midiendo los recursos que consume cada celda
+
+	Antes y después de cada celda se consulta el uso de recursos del núcleo
+	mediante una expresión de usuario en una ejecución silenciosa, así que
+	las medidas no aparecen en el cuaderno ni en su historial.
+	"""
+
+	def __init__(self, **kwargs):
+		super().__init__(**kwargs)
+		self.report = []  # (índice, tiempo, tiempo de CPU, memoria, aumento de memoria)
+
+	def resource_usage(self):
+		"""Tiempo de CPU y máximo de memoria del núcleo (None si no se conoce)"""
+
+		msg_id = self.kc.execute('', silent=True, store_history=False, user_expressions={'uso': USAGE_EXPR})
+		reply = self.wait_for_reply(msg_id)
+
+		if reply is None or (usage := reply['content'].get('user_expressions', {}).get('uso', {})).get('status') != 'ok':
+			return None
+
+		return ast.literal_eval(usage['data']['text/plain'])
+
+	def preprocess_cell(self, cell, resources, index):
+		if cell.cell_type != 'code':
+			return super().preprocess_cell(cell, resources, index)
+
+		before = self.resource_usage()
+		start = time.perf_counter()
+		cell, resources = super().preprocess_cell(cell, resources, index)
+		wall = time.perf_counter() - start
+		after = self.resource_usage()
+
+		cpu = rss = growth = None
+
+		if before is not None and after is not None:
+			cpu = after[0] - before[0]
+			rss, growth = after[1] / 1024, (after[1] - before[1]) / 1024
+
+		cell.metadata['profile'] = dict(wall_time=round(wall, 4),
+		                                 cpu_time=None if cpu is None else round(cpu, 4),
+		                                 peak_rss=None if rss is None else round(rss, 1))
+		self.report.append((index, wall, cpu, rss, growth))
+
+		return cell, resources
+
+
+def execute(filename, nb, pool: KernelPool, timeout: int, ep):
+	"""Ejecuta un cuaderno en un núcleo del conjunto (devuelve si ha terminado)"""
+
+	km = pool.acquire(os.path.dirname(os.path.abspath(filename)))
+
+	# Si se agota el tiempo del cuaderno se apaga su núcleo, lo que
+	# interrumpe la celda que se esté ejecutando
+	timer = threading.Timer(timeout, km.shutdown_kernel, kwargs={'now': True})
+	timer.start()
+
+	try:
+		ep.preprocess(nb, km=km)
+
+	except Exception as e:
+		print(f'Error al ejecutar {filename}: {type(e).__name__} {e}')
+		return False
+
+	finally:
+		timer.cancel()
+		pool.release(km)
+
+	import nbformat
+
+	with open(filename, 'w') as f:
 		nbformat.write(nb, f)
 
+	return True
+
+
+def execute_all(jobs: dict, workers: int, task):
+	"""Aplica task(filename, pool, *args) a los cuadernos de jobs en paralelo
+
+	Devuelve un diccionario con el resultado de cada cuaderno o None
+	si no ha terminado.
+	"""
+
+	results = {}
+	pool = KernelPool(workers, len(jobs))
+
+	try:
+		with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+			futures = {executor.submit(task, filename, pool, *args): filename for filename, args in jobs.items()}
+
+			for future in concurrent.futures.as_completed(futures):
+				try:
+					results[futures[future]] = future.result()
+
+				# El cuaderno no se puede leer o el núcleo no ha arrancado
+				except Exception as e:
+					print(f'Error al ejecutar {futures[future]}: {type(e).__name__} {e}')
+					results[futures[future]] = None
+	finally:
+		pool.close()
+
+	return results
+
+
+def run_one(filename, pool: KernelPool, timeout: int, start=0):
+	"""Ejecuta un cuaderno en un núcleo del conjunto y lo actualiza
+
+	Solo se ejecutan las celdas a partir de start. Devuelve las celdas
+	con errores o None si el cuaderno no ha terminado.
+	"""
+
+	import nbformat
+
+	with open(filename) as ipynb:
+		nb = nbformat.read(ipynb, as_version=4)
+
+	chain = code_chain(nb)
+
+	# Punto de control con el estado del núcleo antes de la primera celda ejecutada
+	checkpoint = None
+
+	if previous := next((digest for digest in reversed(chain[:start]) if digest is not None), None):
+		checkpoint = os.path.abspath(os.path.join(CACHE_DIR, f'{previous}.pkl'))
+
+	ep = executor_class(IncrementalExecutor)(start, checkpoint, timeout=timeout, kernel_name=pool.kernel_name,
+	                         allow_errors=True, record_timing=False)
+
+	if not execute(filename, nb, pool, timeout, ep):
+		return None
+
+	# Se recuerda qué código se ha ejecutado
+	with open(state_file(filename), 'w') as sfile:
+		json.dump(chain, sfile)
+
+	return error_cells(nb)
+
+
+def run(filenames, args):
+	"""Ejecuta los cuadernos en paralelo y actualiza sus celdas"""
+
+	os.makedirs(CACHE_DIR, exist_ok=True)
+
+	results = {}
+	pending = {}  # primera celda que hay que ejecutar de cada cuaderno
+
+	for filename in filenames:
+		if args.full:
+			pending[filename] = 0
+			continue
+
+		nb = Notebook(filename)
+
+		# Los cuadernos cuyo código no ha cambiado no se ejecutan ni se reescriben
+		if (start := first_changed(filename, nb)) is None:
+			results[filename] = error_cells(nb)
+		else:
+			pending[filename] = start
+
+	workers = args.j or max(1, min(len(pending), os.cpu_count() or 1))
+	results |= execute_all({filename: (args.timeout, start) for filename, start in pending.items()}, workers, run_one)
+
+	# Resumen de los cuadernos y de las celdas con errores (en el orden de entrada)
+	for filename in filenames:
+		if (errors := results[filename]) is None:
+			print(f'✗ {filename} (no ha terminado)')
+		else:
+			status = 'sin cambios' if filename not in pending else f'desde la celda {pending[filename]}'
+			print(f'✓ {filename} ({status})' + (f', {len(errors)} celdas con errores' if errors else ''))
+
+			for k, ename, evalue in errors:
+				print(f'    [{k}] {ename}: {evalue}')
+
+	return 0 if all(errors is not None for errors in results.values()) else 1
+
+
+def profile_one(filename, pool: KernelPool, timeout: int):
+	"""Ejecuta un cuaderno entero midiendo cada celda (devuelve las medidas)"""
+
+	import nbformat
+
+	with open(filename) as ipynb:
+		nb = nbformat.read(ipynb, as_version=4)
+
+	ep = executor_class(ProfilingExecutor)(timeout=timeout, kernel_name=pool.kernel_name, allow_errors=True)
+
+	return ep.report if execute(filename, nb, pool, timeout, ep) else None
+
+
+def profile(filenames, args):
+	"""Mide el tiempo y la memoria de cada celda y señala las que se exceden"""
+
+	# Por defecto se ejecuta un cuaderno cada vez para que las
+	# ejecuciones simultáneas no falseen las medidas
+	results = execute_all({filename: (args.timeout,) for filename in filenames}, args.j or 1, profile_one)
+
+	report_file = args.o or os.path.join(CACHE_DIR, 'perfil.csv')
+	os.makedirs(os.path.dirname(report_file) or '.', exist_ok=True)
+
+	exceeded = 0
+
+	with open(report_file, 'w', newline='') as rfile:
+		writer = csv.writer(rfile)
+		writer.writerow(('cuaderno', 'celda', 'tiempo', 'cpu', 'memoria', 'aumento', 'excede'))
+
+		for filename in filenames:
+			if (report := results[filename]) is None:
+				print(f'✗ {filename} (no ha terminado)')
+				continue
+
+			print(f'✓ {filename} ({sum(wall for _, wall, *_ in report):.2f} s)')
+
+			for k, wall, cpu, rss, growth in report:
+				# Se comprueba el tiempo real y el aumento del máximo de memoria
+				excess = []
+
+				if wall > args.max_time:
+					excess.append('tiempo')
+				if growth is not None and growth > args.max_memory:
+					excess.append('memoria')
+
+				if excess:
+					exceeded += 1
+					print(f'    [{k}] {wall:.2f} s' + ('' if cpu is None else f', {cpu:.2f} s de CPU')
+					      + ('' if growth is None else f', +{growth:.1f} MiB (máximo {rss:.1f} MiB)'))
+
+				writer.writerow((filename, k, f'{wall:.4f}', '' if cpu is None else f'{cpu:.4f}',
+				                 '' if rss is None else f'{rss:.1f}', '' if growth is None else f'{growth:.1f}',
+				                 ' '.join(excess)))
+
+	print(f'Informe guardado en {report_file}' + (f' ({exceeded} celdas exceden los límites)' if exceeded else ''))
+
+	return 0 if exceeded == 0 and all(report is not None for report in results.values()) else 1
+
 
 def main():
 	import argparse
 
 	parser = argparse.ArgumentParser(description='Herramientas para cuadernos de Jupyter')
-	parser.add_argument('action', choices=['mypy', 'lang', 'run', 'reduce'], default='mypy')
-	parser.add_argument('cuaderno', help='Cuaderno')
-	parser.add_argument('-o', help='Guarda la salida de lang como un archivo HTML')
+	parser.add_argument('action', choices=['mypy', 'lang', 'run', 'profile', 'reduce'], default='mypy')
+	parser.add_argument('cuaderno', help='Cuaderno', nargs='+')
+	parser.add_argument('-o', help='Guarda la salida de lang como un archivo HTML o el informe de profile')
+	parser.add_argument('-j', help='Cuadernos que run ejecuta a la vez (por defecto, tantos como núcleos)',
+	                    type=int, metavar='N')
+	parser.add_argument('--timeout', help='Tiempo máximo de ejecución de cada cuaderno en segundos',
+	                    type=int, default=600)
+	parser.add_argument('--full', help='Ejecuta todas las celdas aunque no hayan cambiado', action='store_true')
+	parser.add_argument('--daemon', help='Comprueba los tipos con el demonio de mypy', action='store_true')
+	parser.add_argument('--max-time', help='Tiempo máximo de cada celda para profile en segundos',
+	                    type=float, default=10)
+	parser.add_argument('--max-memory', help='Aumento máximo de memoria de cada celda para profile en MiB',
+	                    type=float, default=512)
 
 	args = parser.parse_args()
 
-	# Lee el cuaderno de Jupyter
-	with open(args.cuaderno) as ipynb:
-		nb = nbformat.read(ipynb, as_version=4)
+	# Los cuadernos se ejecutan en paralelo
+	if args.action == 'run':
+		return run(args.cuaderno, args)
+
+	if args.action == 'profile':
+		return profile(args.cuaderno, args)
+
+	# Todos los cuadernos se comprueban con una sola ejecución de mypy
+	if args.action == 'mypy':
+		return mypy(args.cuaderno, args)
+
+	acciones = dict(lang=lang, reduce=reduce)
+
+	for cuaderno in args.cuaderno:
+		# Ejecuta la acción correspondiente sobre el cuaderno de Jupyter
+		acciones[args.action](cuaderno, Notebook(cuaderno), args)
 
-	# Ejecuta la acción correspondiente
-	acciones = dict(mypy=mypy, lang=lang, run=run, reduce=reduce)
-	acciones[args.action](nb, args)
 	return 0
 
 
 if __name__ == '__main__':
-	main()
-
+	sys.exit(main())